@@ -0,0 +1,387 @@
+"""
+Benchmarks
+
+Fills a database with a large synthetic question bank and times every
+endpoint through the Flask test client, reporting p50/p99 latency and
+throughput. Results can be saved as a baseline, and later runs compared
+against it:
+
+    python benchmark.py --questions 100000 --save before
+    ... change something ...
+    python benchmark.py --questions 100000 --compare before
+
+By default the database is a SQLite file in benchmarks/, which is reused
+while it has the requested number of questions (--rebuild to regenerate).
+Use --database to run against Postgres instead, on a database created
+with 'flask db upgrade'. The questions and categories in it are replaced.
+"""
+
+import argparse
+import concurrent.futures
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+
+from sqlalchemy import delete, func, insert, select
+
+from flaskr import create_app
+from models import Category, Question, db, text_hash
+from quiz_sessions import quiz_sessions
+
+BENCHMARK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+DEFAULT_DATABASE = "sqlite:///" + os.path.join(BENCHMARK_DIR, "benchmark.db")
+
+DEFAULT_QUESTIONS = 100000
+DEFAULT_REQUESTS = 200
+INSERT_BATCH_SIZE = 10000
+WARMUP_REQUESTS = 3
+SEED = 20240501
+
+# the categories of trivia.psql
+CATEGORIES = ["Science", "Art", "Geography", "History", "Entertainment", "Sports"]
+
+VOCABULARY_SIZE = 5000
+QUESTION_WORDS = (6, 14)
+ANSWER_WORDS = (1, 4)
+
+# a change in p50 or p99 above this is reported as a regression
+REGRESSION_PERCENT = 20
+
+# rows per POST /questions/bulk request
+BULK_ROWS = 100
+
+# sessions for POST /quiz/sessions/token/next to draw from
+QUIZ_SESSIONS = 10
+
+
+def _vocabulary(rng):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = set()
+    while len(words) < VOCABULARY_SIZE:
+        words.add("".join(rng.choice(letters) for _ in range(rng.randint(3, 10))))
+    return sorted(words)
+
+
+def _sentence(rng, vocabulary, word_counts):
+    return " ".join(rng.choice(vocabulary) for _ in range(rng.randint(*word_counts)))
+
+
+def _question_row(rng, vocabulary, number, category_count):
+    # the number keeps questions and answers unique
+    question = _sentence(rng, vocabulary, QUESTION_WORDS).capitalize() + " (" + str(number) + ")?"
+    answer = _sentence(rng, vocabulary, ANSWER_WORDS) + " " + str(number)
+    return {
+        "question": question,
+        "answer": answer,
+        "question_hash": text_hash(question),
+        "answer_hash": text_hash(answer),
+        "category": rng.randint(1, category_count),
+        "difficulty": rng.randint(1, 5)
+    }
+
+
+def populate(app, question_count, rebuild=False, seed=SEED):
+    """
+    Fill the app's database with 'question_count' synthetic questions,
+    unless it already has that many and not 'rebuild'
+    """
+    questions = Question.__table__
+    categories = Category.__table__
+
+    with app.app_context():
+        db.create_all()
+        existing = db.session.execute(select(func.count(questions.c.id))).scalar()
+        if existing == question_count and not rebuild:
+            return False
+
+        db.session.execute(delete(questions))
+        db.session.execute(delete(categories))
+        db.session.execute(insert(categories), [
+            {"id": i, "type": category_type} for i, category_type in enumerate(CATEGORIES, start=1)
+        ])
+
+        rng = random.Random(seed)
+        vocabulary = _vocabulary(rng)
+        for start in range(0, question_count, INSERT_BATCH_SIZE):
+            db.session.execute(insert(questions), [
+                _question_row(rng, vocabulary, number, len(CATEGORIES))
+                for number in range(start, min(start + INSERT_BATCH_SIZE, question_count))
+            ])
+        db.session.commit()
+
+    return True
+
+
+class Context:
+    """
+    What the scenarios need to know about the data, and the ids created
+    by the write scenarios so they can be removed again
+    """
+
+    def __init__(self, app, seed=SEED):
+        self.rng = random.Random(seed)
+        self.vocabulary = _vocabulary(random.Random(seed))
+        with app.app_context():
+            questions = Question.__table__
+            self.question_count = db.session.execute(select(func.count(questions.c.id))).scalar()
+            self.max_id = db.session.execute(select(func.max(questions.c.id))).scalar() or 0
+        self.last_page = max(1, self.question_count // 10)
+        self.created_ids = []
+        self.session_tokens = [quiz_sessions.create(None) for _ in range(QUIZ_SESSIONS)]
+        self.etag = None
+        self.counter = 0
+
+    def next_number(self):
+        self.counter += 1
+        return str(self.counter) + "-" + str(time.time_ns())
+
+    def word(self):
+        return self.rng.choice(self.vocabulary)
+
+
+def _get(path):
+    return lambda ctx: ("GET", path, {})
+
+
+def _new_question(ctx):
+    number = ctx.next_number()
+    return {
+        "question": "Benchmark question " + number + "?",
+        "answer": "Benchmark answer " + number,
+        "category": ctx.rng.randint(1, len(CATEGORIES)),
+        "difficulty": ctx.rng.randint(1, 5)
+    }
+
+
+def _remember_created(ctx, data):
+    ctx.created_ids += data.get("question_ids") or [data["question_id"]]
+
+
+def _remember_etag(ctx, response):
+    ctx.etag = response.headers.get("ETag")
+
+
+def _delete_created(ctx):
+    question_id = ctx.created_ids.pop() if ctx.created_ids else 0
+    return ("DELETE", "/questions/" + str(question_id), {})
+
+
+"""
+Scenarios: (name, request(ctx) -> (method, path, client kwargs), requests
+as a fraction of --requests, after(ctx, json) or None). The requests of
+each scenario run in order, so the DELETE scenario removes what the
+POST scenarios added.
+"""
+SCENARIOS = [
+    ("GET /questions", _get("/questions"), 1, None),
+    ("GET /questions last page", lambda ctx: ("GET", "/questions?page=" + str(ctx.last_page), {}), 1, None),
+    ("GET /questions cursor", lambda ctx: (
+        "GET", "/questions?after_id=" + str(ctx.rng.randint(0, ctx.max_id)), {}
+    ), 1, None),
+    ("GET /questions 304", lambda ctx: ("GET", "/questions", {"headers": {"If-None-Match": ctx.etag or ""}}), 1, None),
+    ("GET /categories", _get("/categories"), 1, None),
+    ("GET /categories/id/questions", lambda ctx: (
+        "GET", "/categories/" + str(ctx.rng.randint(1, len(CATEGORIES))) + "/questions", {}
+    ), 1, None),
+    ("GET /categories/id/questions last page", lambda ctx: (
+        "GET", "/categories/1/questions?page=" + str(max(1, ctx.last_page // len(CATEGORIES))), {}
+    ), 1, None),
+    ("POST /questions/search", lambda ctx: (
+        "POST", "/questions/search", {"json": {"searchTerm": ctx.word()[:4]}}
+    ), 1, None),
+    ("POST /questions/search answers", lambda ctx: (
+        "POST", "/questions/search", {"json": {"searchTerm": ctx.word() + " " + ctx.word()[:2], "searchAnswers": True}}
+    ), 1, None),
+    ("POST /quiz", lambda ctx: ("POST", "/quiz", {"json": {
+        "previous_questions": [ctx.rng.randint(1, ctx.max_id) for _ in range(20)],
+        "quiz_category_id": ctx.rng.randint(1, len(CATEGORIES))
+    }}), 1, None),
+    ("POST /quiz/deck", lambda ctx: ("POST", "/quiz/deck", {"json": {"size": 10}}), 1, None),
+    ("POST /quiz/sessions", lambda ctx: ("POST", "/quiz/sessions", {"json": {}}), 1, None),
+    ("POST /quiz/sessions/token/next", lambda ctx: (
+        "POST", "/quiz/sessions/" + ctx.rng.choice(ctx.session_tokens) + "/next", {}
+    ), 1, None),
+    ("POST /questions", lambda ctx: ("POST", "/questions", {"json": _new_question(ctx)}), 0.5, _remember_created),
+    ("POST /questions/bulk", lambda ctx: (
+        "POST", "/questions/bulk", {"json": [_new_question(ctx) for _ in range(BULK_ROWS)]}
+    ), 0.05, _remember_created),
+    ("DELETE /questions/id", _delete_created, 0.5, None),
+    ("GET /questions/export", _get("/questions/export"), 0.02, None),
+]
+
+
+def percentile(sorted_values, percent):
+    """
+    Nearest-rank percentile of an already sorted list
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(percent / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def _send(client, ctx, make_request, after):
+    method, path, kwargs = make_request(ctx)
+    started = time.perf_counter()
+    response = client.open(path, method=method, **kwargs)
+    # read the whole body, so streamed responses are timed to the end
+    body = response.get_data()
+    seconds = time.perf_counter() - started
+
+    if after is not None and response.status_code == 200:
+        after(ctx, json.loads(body))
+    if response.status_code == 200 and response.headers.get("ETag"):
+        _remember_etag(ctx, response)
+    return seconds, response.status_code < 400
+
+
+def run_scenario(app, ctx, make_request, count, after=None, concurrency=1):
+    client = app.test_client()
+    first_seconds, _ = _send(client, ctx, make_request, after)
+    for _ in range(WARMUP_REQUESTS - 1):
+        _send(client, ctx, make_request, after)
+
+    started = time.perf_counter()
+    if concurrency > 1 and after is None:
+        with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(
+                lambda _: _send(app.test_client(), ctx, make_request, None), range(count)
+            ))
+    else:
+        results = [_send(client, ctx, make_request, after) for _ in range(count)]
+    wall_seconds = time.perf_counter() - started
+
+    latencies = sorted(seconds * 1000 for seconds, _ in results)
+    return {
+        "requests": count,
+        "errors": sum(1 for _, ok in results if not ok),
+        "first_ms": round(first_seconds * 1000, 3),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+        "throughput": round(count / wall_seconds, 1) if wall_seconds else None
+    }
+
+
+def run_benchmarks(app, requests=DEFAULT_REQUESTS, concurrency=1, only=None, seed=SEED):
+    """
+    Time every scenario (or those with 'only' in their name).
+    Returns {scenario name: result}.
+    """
+    ctx = Context(app, seed)
+    results = {}
+    for name, make_request, share, after in SCENARIOS:
+        if only and only not in name:
+            continue
+        count = max(1, int(requests * share))
+        results[name] = run_scenario(app, ctx, make_request, count, after, concurrency)
+
+    # whatever the DELETE scenario did not get to
+    client = app.test_client()
+    for question_id in ctx.created_ids:
+        client.delete("/questions/" + str(question_id))
+
+    return results
+
+
+def _change(current, baseline):
+    if not baseline:
+        return ""
+    return "%+.0f%%" % ((current - baseline) / baseline * 100)
+
+
+def report(results, baseline=None, out=sys.stdout):
+    """
+    Print the results as a table, with the change from the baseline's.
+    Returns the names of the scenarios that regressed.
+    """
+    baseline_results = (baseline or {}).get("results", {})
+    regressions = []
+
+    header = "%-40s %8s %6s %9s %9s %9s" % ("endpoint", "requests", "errors", "p50 ms", "p99 ms", "req/s")
+    if baseline:
+        header += " %8s %8s" % ("p50", "p99")
+    print(header, file=out)
+
+    for name, result in results.items():
+        line = "%-40s %8d %6d %9.2f %9.2f %9.1f" % (
+            name, result["requests"], result["errors"], result["p50_ms"], result["p99_ms"], result["throughput"] or 0
+        )
+        previous = baseline_results.get(name)
+        if previous:
+            line += " %8s %8s" % (
+                _change(result["p50_ms"], previous["p50_ms"]), _change(result["p99_ms"], previous["p99_ms"])
+            )
+            if any(
+                previous[key] and (result[key] - previous[key]) / previous[key] * 100 > REGRESSION_PERCENT
+                for key in ("p50_ms", "p99_ms")
+            ):
+                regressions.append(name)
+                line += "  regressed"
+        print(line, file=out)
+
+    return regressions
+
+
+def _baseline_path(name):
+    return os.path.join(BENCHMARK_DIR, name + ".json")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time every endpoint against a large synthetic question bank.")
+    parser.add_argument("--database", default=DEFAULT_DATABASE, help="SQLAlchemy database URI")
+    parser.add_argument("--questions", type=int, default=DEFAULT_QUESTIONS, help="number of questions to generate")
+    parser.add_argument("--rebuild", action="store_true", help="regenerate the questions even if the count matches")
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS, help="timed requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=1, help="clients sending the read requests at once")
+    parser.add_argument("--only", help="only run the scenarios with this in their name")
+    parser.add_argument("--save", metavar="NAME", help="save the results as benchmarks/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="compare with benchmarks/NAME.json")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="exit with status 1 if p50 or p99 regressed by more than " + str(REGRESSION_PERCENT) + "%%")
+    args = parser.parse_args(argv)
+
+    os.makedirs(BENCHMARK_DIR, exist_ok=True)
+
+    app = create_app({"SQLALCHEMY_DATABASE_URI": args.database, "STARTUP_MODE": "production"})
+
+    started = time.perf_counter()
+    if populate(app, args.questions, args.rebuild):
+        print("Generated %d questions in %.1f s" % (args.questions, time.perf_counter() - started))
+
+    baseline = None
+    if args.compare:
+        with open(_baseline_path(args.compare)) as f:
+            baseline = json.load(f)
+
+    results = run_benchmarks(app, args.requests, args.concurrency, args.only)
+    regressions = report(results, baseline)
+
+    if args.save:
+        with open(_baseline_path(args.save), "w") as f:
+            json.dump({
+                "meta": {
+                    "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                    "database": args.database.split(":")[0],
+                    "questions": args.questions,
+                    "requests": args.requests,
+                    "concurrency": args.concurrency,
+                    "python": platform.python_version(),
+                    "machine": platform.machine()
+                },
+                "results": results
+            }, f, indent=2)
+        print("Saved " + _baseline_path(args.save))
+
+    if regressions and args.fail_on_regression:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
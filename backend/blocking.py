@@ -0,0 +1,21 @@
+"""
+Blocking calls under the ASGI server
+"""
+
+import asyncio
+
+from sqlalchemy.util.concurrency import await_only, in_greenlet
+
+
+def run_blocking(fn, *args):
+    """
+    fn(*args), run in a thread when called from a request greenlet of the
+    ASGI server (see flaskr.asgi), so that the event loop serves the other
+    requests meanwhile. Called directly everywhere else.
+
+    fn must not wait on a lock held by a greenlet, as that greenlet's
+    thread is the event loop's.
+    """
+    if not in_greenlet():
+        return fn(*args)
+    return await_only(asyncio.to_thread(fn, *args))
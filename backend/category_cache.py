@@ -0,0 +1,52 @@
+"""
+In-process category cache
+"""
+
+import threading
+
+
+class CategoryCache:
+    """
+    Holds the {id: type} map of categories that the read endpoints return,
+    together with a version number.
+
+    Categories almost never change, so the map is loaded from the database
+    once and then served from memory. Every category write calls bump(),
+    which increments the version and drops the map so that the next read
+    reloads it.
+
+    loader(session) must return an iterable of (id, type) rows.
+    """
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._version = 0
+        self._categories = None
+
+    @property
+    def version(self):
+        return self._version
+
+    def get(self, session=None):
+        """
+        Returns the {id: type} map. Callers must not modify it.
+        """
+        categories = self._categories
+        if categories is not None:
+            return categories
+
+        version = self._version
+        categories = {cat_id: cat_type for cat_id, cat_type in self._loader(session)}
+
+        with self._lock:
+            # only keep it if there was no write while we were loading
+            if self._version == version:
+                self._categories = categories
+
+        return categories
+
+    def bump(self):
+        with self._lock:
+            self._version += 1
+            self._categories = None
@@ -0,0 +1,100 @@
+"""
+In-process question counts
+"""
+
+import threading
+import time
+
+RESYNC_SECONDS = 60
+
+
+class QuestionCounter:
+    """
+    Holds the total number of questions and the number per category,
+    so that listing endpoints do not run a full-table count on every call.
+
+    The counts are loaded from the database on first use, kept up to date
+    by the write paths in models.py, and re-synced from the database every
+    'resync_seconds' to pick up writes made by other processes.
+
+    loader(session) must return an iterable of (category_id, count) rows.
+    """
+
+    def __init__(self, loader, resync_seconds=RESYNC_SECONDS):
+        self._loader = loader
+        self._resync_seconds = resync_seconds
+        self._lock = threading.Lock()
+        self._by_category = None
+        self._total = 0
+        self._synced_at = 0.0
+
+    def configure(self, resync_seconds):
+        with self._lock:
+            self._resync_seconds = resync_seconds
+
+    def invalidate(self):
+        """
+        Drop the counts, they will be reloaded on next read
+        """
+        with self._lock:
+            self._by_category = None
+
+    def sync(self, session=None):
+        rows = self._loader(session)
+        by_category = {}
+        total = 0
+        for category_id, count in rows:
+            total += count
+            if category_id is not None:
+                by_category[category_id] = count
+
+        with self._lock:
+            self._by_category = by_category
+            self._total = total
+            self._synced_at = time.monotonic()
+
+    def _ensure_synced(self, session):
+        stale = (
+            self._by_category is None
+            or time.monotonic() - self._synced_at >= self._resync_seconds
+        )
+        if stale:
+            self.sync(session)
+
+    def total(self, session=None):
+        self._ensure_synced(session)
+        return self._total
+
+    def by_category(self, session=None):
+        """
+        Returns a copy of the {category_id: count} map
+        """
+        self._ensure_synced(session)
+        with self._lock:
+            return dict(self._by_category)
+
+    def added(self, category_id, n=1):
+        with self._lock:
+            if self._by_category is None:
+                return
+            self._total += n
+            if category_id is not None:
+                self._by_category[category_id] = self._by_category.get(category_id, 0) + n
+
+    def removed(self, category_id, n=1):
+        with self._lock:
+            if self._by_category is None:
+                return
+            self._total = max(self._total - n, 0)
+            if category_id is not None and category_id in self._by_category:
+                self._by_category[category_id] = max(self._by_category[category_id] - n, 0)
+
+    def category_removed(self, category_id):
+        """
+        A category and (by cascade) all its questions were deleted
+        """
+        with self._lock:
+            if self._by_category is None:
+                return
+            count = self._by_category.pop(category_id, 0)
+            self._total = max(self._total - count, 0)
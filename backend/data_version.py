@@ -0,0 +1,151 @@
+"""
+Data version
+"""
+
+import os
+import secrets
+import threading
+
+from blocking import run_blocking
+
+
+class DataVersion:
+    """
+    A version string that changes whenever questions or categories are
+    written, used as the ETag of the read endpoints.
+
+    It is made of a random epoch, so that versions from before a restart
+    are never reused, and a counter bumped by the write paths in models.py.
+
+    By default the version lives in this process. Behind several worker
+    processes, share() it through a file: every process then reports the
+    same version, and refresh() tells a process that another one wrote,
+    so that it can drop its caches (see models.sync_caches).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._epoch = secrets.token_hex(4)
+        self._counter = 0
+        self._path = None
+        # the shared version as of this process' last look
+        self._seen = None
+
+    def share(self, path):
+        """
+        Keep the version in the file at 'path', or in this process if None
+        """
+        with self._lock:
+            self._path = path
+            self._seen = None
+
+    def current(self):
+        if self._path is not None:
+            version = run_blocking(self._read)
+            if version:
+                return version
+        return self._epoch + "-" + str(self._counter)
+
+    def bump(self):
+        with self._lock:
+            self._counter += 1
+            if self._path is None:
+                return
+
+        # the file lock and I/O are not done under self._lock, which
+        # would block the event loop of the ASGI server meanwhile
+        version, bumped = run_blocking(self._bump_file)
+
+        with self._lock:
+            # otherwise another process wrote since refresh() last looked,
+            # and the next refresh() must still report it
+            if version == self._seen:
+                self._seen = bumped
+
+    def _bump_file(self):
+        """
+        (version, bumped): the shared version before and after the bump
+        """
+        with self._file_lock():
+            version = self._read()
+            epoch, _, counter = (version or "").rpartition("-")
+            if not epoch or not counter.isdigit():
+                epoch, counter = self._epoch, "0"
+            bumped = epoch + "-" + str(int(counter) + 1)
+            self._write(bumped)
+        return version, bumped
+
+    def refresh(self):
+        """
+        (version, changed): the current version, read once, and whether
+        another process changed the shared version since the last call,
+        that is, whether the caches of this process may be out of date
+        """
+        if self._path is None:
+            return self.current(), False
+
+        version = run_blocking(self._read)
+        with self._lock:
+            changed = version != self._seen
+            self._seen = version
+        return version or self.current(), changed
+
+    def reset(self):
+        with self._lock:
+            self._epoch = secrets.token_hex(4)
+            self._counter = 0
+            if self._path is None:
+                return
+            # a new epoch for every process, as after a restart
+            version = self._epoch + "-0"
+
+        run_blocking(self._write_locked, version)
+        with self._lock:
+            self._seen = version
+
+    def _write_locked(self, version):
+        with self._file_lock():
+            self._write(version)
+
+    def _read(self):
+        try:
+            with open(self._path, encoding="ascii") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, version):
+        # readers see the old or the new version, never a partial one
+        temp_path = self._path + "." + str(os.getpid()) + ".tmp"
+        with open(temp_path, "w", encoding="ascii") as f:
+            f.write(version)
+        os.replace(temp_path, self._path)
+
+    def _file_lock(self):
+        return _FileLock(self._path + ".lock")
+
+
+class _FileLock:
+    """
+    An exclusive lock between processes, held for a 'with' block
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._file = None
+
+    def __enter__(self):
+        # Unix only, like the multi-worker servers that share the version
+        import fcntl
+
+        self._file = open(self._path, "a")
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        # closing the file releases the lock
+        self._file.close()
+        self._file = None
+
+
+data_version = DataVersion()
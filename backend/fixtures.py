@@ -0,0 +1,203 @@
+"""
+Test fixtures
+
+The tests share one app per process. Each test runs inside a transaction
+on a single connection, which is rolled back afterwards, so tests can
+write freely and the next one still sees the trivia.psql data.
+
+The database is TEST_DATABASE_URL if set ("sqlite" for short selects the
+in-memory database), otherwise the trivia_test Postgres database when
+PGPASSWORD is set (see test.sh), otherwise an in-memory SQLite database
+seeded from trivia.psql. That needs no database server and is private to
+the process, so the tests can run in parallel:
+
+    TEST_DATABASE_URL=sqlite python -m pytest -n auto
+"""
+
+import os
+import re
+import sqlite3
+import unittest
+
+from dotenv import load_dotenv
+from sqlalchemy import event, func, insert, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import SingletonThreadPool
+
+from data_version import data_version
+from flaskr import create_app
+from flaskr.startup import BACKEND_DIR, migration_scripts
+from models import (
+    Category, Question, db, text_hash,
+    question_counter, category_cache, question_search, question_sampler
+)
+from quiz_sessions import quiz_sessions
+
+load_dotenv()
+
+TRIVIA_DATA = os.path.join(BACKEND_DIR, "trivia.psql")
+
+# a named in-memory database, so that apps made by the tests share it
+SQLITE_MEMORY_URL = "sqlite:///file:/trivia_test?mode=memory&cache=shared&uri=true"
+
+
+def _database_url():
+    url = os.getenv("TEST_DATABASE_URL")
+    if url == "sqlite":
+        return SQLITE_MEMORY_URL
+    if url:
+        return url
+
+    password = os.getenv("PGPASSWORD")
+    if password:
+        return 'postgresql://postgres:' + password + '@localhost:5432/trivia_test'
+    return SQLITE_MEMORY_URL
+
+
+DATABASE_URL = _database_url()
+IS_SQLITE = make_url(DATABASE_URL).get_backend_name() == "sqlite"
+IS_SQLITE_MEMORY = IS_SQLITE and make_url(DATABASE_URL).query.get("mode") == "memory"
+
+# for apps made by the tests, with their own settings on top
+TEST_CONFIG = {
+    "SQLALCHEMY_DATABASE_URI": DATABASE_URL,
+    "STARTUP_MODE": "production"
+}
+if IS_SQLITE_MEMORY:
+    # a connection per thread, all to the same database
+    TEST_CONFIG["SQLALCHEMY_ENGINE_OPTIONS"] = {"poolclass": SingletonThreadPool}
+
+_app = None
+# keeps the in-memory database alive for as long as the process
+_keep_alive = None
+
+
+def read_trivia_data(path=TRIVIA_DATA):
+    """
+    The rows of the COPY blocks of a pg_dump file, as {table: [row dicts]}
+    """
+    with open(path, encoding="utf-8") as f:
+        dump = f.read()
+
+    tables = {}
+    for table, columns, body in re.findall(r"COPY public\.(\w+) \(([^)]*)\) FROM stdin;\n(.*?)^\\\.$", dump, re.S | re.M):
+        names = [name.strip() for name in columns.split(",")]
+        tables[table] = [
+            dict(zip(names, (None if value == "\\N" else value for value in line.split("\t"))))
+            for line in body.splitlines() if line
+        ]
+    return tables
+
+
+def seed(connection):
+    """
+    Create the schema and load the trivia.psql data, unless there are already
+    questions, and record the schema as being at the latest migration
+    """
+    from alembic.runtime.migration import MigrationContext
+
+    db.metadata.create_all(connection)
+    if connection.execute(select(func.count(Question.__table__.c.id))).scalar():
+        return
+
+    data = read_trivia_data()
+    connection.execute(insert(Category.__table__), [
+        {"id": int(row["id"]), "type": row["type"]} for row in data["categories"]
+    ])
+    connection.execute(insert(Question.__table__), [
+        {
+            "id": int(row["id"]),
+            "question": row["question"],
+            "answer": row["answer"],
+            "question_hash": text_hash(row["question"]),
+            "answer_hash": text_hash(row["answer"]),
+            "difficulty": int(row["difficulty"]),
+            "category": None if row["category"] is None else int(row["category"])
+        }
+        for row in data["questions"]
+    ])
+    MigrationContext.configure(connection).stamp(migration_scripts(), "head")
+
+
+def _use_savepoints(engine):
+    """
+    pysqlite begins transactions itself, and not before a SAVEPOINT.
+    Leave it to SQLAlchemy, so that the savepoints of the tests work,
+    and turn on foreign keys, which SQLite only enforces when asked.
+    """
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+    @event.listens_for(engine, "begin")
+    def begin(connection):
+        connection.exec_driver_sql("BEGIN")
+
+
+def get_app():
+    """
+    The app shared by the tests, made on first use
+    """
+    global _app, _keep_alive
+    if _app is not None:
+        return _app
+
+    if IS_SQLITE_MEMORY:
+        _keep_alive = sqlite3.connect(make_url(DATABASE_URL).database + "?mode=memory&cache=shared", uri=True)
+
+    app = create_app(TEST_CONFIG)
+    with app.app_context():
+        if IS_SQLITE:
+            _use_savepoints(db.engine)
+            with db.engine.begin() as connection:
+                seed(connection)
+
+        # sessions join the test's transaction through a savepoint,
+        # so that their commits and rollbacks stay inside it
+        db.session.configure(join_transaction_mode="create_savepoint")
+
+    _app = app
+    return app
+
+
+def reset_caches():
+    """
+    Drop everything the in-process caches learnt during a test
+    """
+    question_counter.invalidate()
+    category_cache.bump()
+    data_version.reset()
+    question_search.invalidate()
+    question_sampler.invalidate()
+    quiz_sessions.clear()
+
+
+class AppTestCase(unittest.TestCase):
+    """
+    A test against the shared app, with an app context pushed, inside a
+    transaction that is rolled back after the test
+    """
+
+    def setUp(self):
+        self.app = get_app()
+        self.client = self.app.test_client
+
+        self._app_context = self.app.app_context()
+        self._app_context.push()
+
+        engines = db.engines
+        self._engine = engines[None]
+        self._connection = self._engine.connect()
+        self._transaction = self._connection.begin()
+        # the sessions of the app use the connection in place of the engine
+        engines[None] = self._connection
+        reset_caches()
+
+    def tearDown(self):
+        db.session.remove()
+        db.engines[None] = self._engine
+        self._transaction.rollback()
+        self._connection.close()
+        self._app_context.pop()
+        reset_caches()
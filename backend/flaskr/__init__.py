@@ -1,18 +1,45 @@
-from flask import Flask
+import time
+
+import click
+from flask import Flask, g
 from flask_cors import CORS
-from models import setup_db
+from models import setup_db, db, sync_caches
 from .routes import init_routes
+from .json_provider import init_json
+from .metrics import init_metrics
+from .slow_queries import init_slow_queries
+from .replicas import init_replicas
+from .startup import MIGRATIONS_DIR, check_schema, get_startup_mode, init_startup, record_boot_time
 
 
 def create_app(test_config=None):
 
+    started = time.perf_counter()
+
     app = Flask("flaskr")
+    # FLASK_ prefixed environment variables, eg. FLASK_STARTUP_MODE=production
+    app.config.from_prefixed_env()
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+
+    create_schema = get_startup_mode(app) == "development"
 
     if test_config is None:
-        setup_db(app)
+        setup_db(app, create_schema=create_schema)
     else:
-        setup_db(app, database_path=test_config.get('SQLALCHEMY_DATABASE_URI'))
+        setup_db(app, database_path=test_config.get('SQLALCHEMY_DATABASE_URI'), create_schema=create_schema)
 
+    if app.config.get("SCHEMA_CHECK", False):
+        check_schema(app, db)
+
+    init_json(app)
+    # Flask-Migrate is only needed for the db commands of the flask command.
+    # Elsewhere, eg. under a WSGI server, importing it and alembic would be
+    # about half of the import time
+    if create_schema or click.get_current_context(silent=True) is not None:
+        from flask_migrate import Migrate
+        Migrate(app, db, directory=MIGRATIONS_DIR)
+    init_startup(app)
     CORS(app)
 
     @app.after_request
@@ -25,6 +52,16 @@ def create_app(test_config=None):
         )
         return response
 
+    init_metrics(app)
+    init_slow_queries(app, db)
+    init_replicas(app)
+
+    @app.before_request
+    def check_data_version():
+        # writes made by the other worker processes, see DATA_VERSION_FILE.
+        # The ETag is this version, not a later one the caches may not have
+        g.data_version = sync_caches()
     init_routes(app)
+    record_boot_time(app, started)
 
     return app
@@ -0,0 +1,186 @@
+"""
+ASGI serving
+
+    uvicorn --factory flaskr.asgi:create_asgi_app
+
+serves the same app, with the same routes and responses, on an event loop.
+The engines use the async drivers (asyncpg, or aiosqlite for SQLite, see
+ASYNC_ENGINES in setup_db) and each request runs in its own greenlet, the
+way AsyncSession.run_sync runs sync code. A request waiting on the database
+hands the loop over to the others, instead of holding a thread, so one
+process serves many requests at once.
+
+Request bodies are read and responses sent as they stream, chunk by chunk,
+and the blocking file and CPU work (see blocking.run_blocking) runs in
+threads.
+"""
+
+import asyncio
+import io
+import sys
+
+from sqlalchemy.util import greenlet_spawn
+from sqlalchemy.util.concurrency import await_only
+
+from models import default_uri, dispose_engines
+from . import create_app
+
+
+def create_asgi_app(test_config=None):
+    config = {"SQLALCHEMY_DATABASE_URI": default_uri}
+    config.update(test_config or {})
+    config["ASYNC_ENGINES"] = True
+    return AsgiApp(config)
+
+
+def _latin1(value):
+    return value.decode("latin-1")
+
+
+class RequestBody(io.RawIOBase):
+    """
+    The body of an ASGI http request, received from the server as the app
+    reads it, so that a large upload (the NDJSON of POST /questions/bulk)
+    is not held in memory whole. Read in the request's greenlet.
+    """
+
+    def __init__(self, receive):
+        self._receive = receive
+        self._chunk = b""
+        self._more = True
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._chunk and self._more:
+            message = await_only(self._receive())
+            if message["type"] == "http.disconnect":
+                # the app sees a truncated body, and its response is dropped
+                self._more = False
+                break
+            self._chunk = message.get("body", b"")
+            self._more = message.get("more_body", False)
+
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+
+def build_environ(scope, body):
+    """
+    The WSGI environ of an ASGI http request, with 'body' as its wsgi.input
+    """
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": _latin1(scope.get("root_path", "").encode("utf-8")),
+        "PATH_INFO": _latin1(scope["path"].encode("utf-8")),
+        "QUERY_STRING": _latin1(scope.get("query_string", b"")),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1] or 80),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+        environ["REMOTE_PORT"] = str(scope["client"][1])
+
+    for name, value in scope.get("headers", ()):
+        name = _latin1(name).upper().replace("-", "_")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = "HTTP_" + name
+        value = _latin1(value)
+        if name in environ:
+            value = environ[name] + "," + value
+        environ[name] = value
+    return environ
+
+
+class AsgiApp:
+    """
+    Runs the Flask app made from 'config' for an ASGI server.
+
+    The app is made, and its engines disposed of, in the greenlet of the
+    lifespan events (or of the first request, if the server sends none),
+    as both can use the database.
+    """
+
+    def __init__(self, config):
+        self._config = config
+        self._starting = asyncio.Lock()
+        self.app = None
+
+    async def startup(self):
+        async with self._starting:
+            if self.app is None:
+                self.app = await greenlet_spawn(create_app, self._config)
+
+    async def shutdown(self):
+        if self.app is not None:
+            await greenlet_spawn(dispose_engines, self.app)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+        else:
+            raise ValueError("Unsupported ASGI scope: " + scope["type"])
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.startup()
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    raise
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope, receive, send):
+        if self.app is None:
+            await self.startup()
+
+        body = io.BufferedReader(RequestBody(receive))
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started["status"] = int(status.split(" ", 1)[0])
+            started["headers"] = headers
+
+        chunks = await greenlet_spawn(self.app, build_environ(scope, body), start_response)
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": started["status"],
+                "headers": [
+                    (name.lower().encode("latin-1"), value.encode("latin-1"))
+                    for name, value in started["headers"]
+                ]
+            })
+            # streamed responses (the export) read from the database as they go
+            iterator = iter(chunks)
+            while True:
+                chunk = await greenlet_spawn(next, iterator, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(chunks, "close"):
+                await greenlet_spawn(chunks.close)
@@ -0,0 +1,50 @@
+"""
+Conditional GET support for the read endpoints
+"""
+
+import functools
+
+from flask import current_app, g, make_response, request
+from data_version import data_version
+from routing import reading_primary
+
+CACHE_MAX_AGE_SECONDS = 0
+
+
+def _set_cache_headers(response, etag):
+    response.set_etag(etag, weak=True)
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config.get(
+        "CACHE_MAX_AGE_SECONDS", CACHE_MAX_AGE_SECONDS
+    )
+    response.cache_control.must_revalidate = True
+
+
+def conditional(view):
+    """
+    Tag the view's responses with the current data version as a weak ETag,
+    and answer a matching If-None-Match with 304 without running the view.
+
+    The version is the primary's, so the view reads from the primary too:
+    a lagging replica would tag an old body with the new version, and the
+    clients and shared caches holding it would keep it until the next write.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        # read the version before the data, so a write while the view
+        # runs can only make the ETag older than the body, never newer.
+        # That is the one the caches were checked against, see create_app
+        etag = g.get("data_version") or data_version.current()
+
+        if request.if_none_match.contains_weak(etag):
+            response = current_app.response_class(status=304)
+            _set_cache_headers(response, etag)
+            return response
+
+        with reading_primary():
+            response = make_response(view(*args, **kwargs))
+        if response.status_code == 200:
+            _set_cache_headers(response, etag)
+        return response
+
+    return wrapper
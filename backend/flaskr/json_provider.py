@@ -0,0 +1,61 @@
+"""
+JSON provider
+
+Uses orjson for response bodies when it is installed,
+otherwise Flask's standard library provider.
+Set JSON_PROVIDER in the app config to "orjson" or "stdlib"
+to choose one (default "auto").
+"""
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+JSON_PROVIDERS = ("auto", "orjson", "stdlib")
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by orjson. Calls with options that only
+    the standard library understands (eg. indent) are passed on to it.
+    """
+
+    # the category map has int keys
+    option = orjson.OPT_NON_STR_KEYS if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self.option).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self.option)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def init_json(app):
+    """
+    Set app.json to the provider chosen by the JSON_PROVIDER config
+    """
+    choice = app.config.get("JSON_PROVIDER", "auto")
+    if choice not in JSON_PROVIDERS:
+        raise ValueError("Unknown JSON provider: " + str(choice))
+
+    if choice == "stdlib":
+        return
+
+    if orjson is None:
+        if choice == "orjson":
+            app.logger.warning("orjson is not installed, using the standard library JSON provider")
+        return
+
+    app.json = OrjsonProvider(app)
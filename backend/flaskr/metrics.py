@@ -0,0 +1,187 @@
+"""
+Request metrics
+
+Records, per endpoint, a latency histogram, response counts by status,
+and the number and duration of the database queries each request ran,
+and serves them in the Prometheus text format at GET /metrics.
+
+The numbers are kept in memory, so each worker process reports its own.
+Set METRICS_ENABLED to False in the app config to turn this off.
+"""
+
+import threading
+import time
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# label for requests that did not match a route
+UNMATCHED_ENDPOINT = "unmatched"
+
+
+class Histogram:
+    """
+    Counts of observations in fixed buckets, plus their sum
+    """
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            total += count
+            yield repr(bound), total
+        yield "+Inf", self.count
+
+
+def _labels(**labels):
+    return "{" + ",".join(
+        name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+        for name, value in labels.items()
+    ) + "}"
+
+
+class RequestMetrics:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._responses = {}
+        self._db_time = {}
+        self._db_queries = {}
+
+    def record(self, endpoint, method, status, seconds, db_queries, db_seconds):
+        with self._lock:
+            self._latency.setdefault((endpoint, method), Histogram()).observe(seconds)
+            key = (endpoint, method, status)
+            self._responses[key] = self._responses.get(key, 0) + 1
+            self._db_time.setdefault(endpoint, Histogram()).observe(db_seconds)
+            self._db_queries[endpoint] = self._db_queries.get(endpoint, 0) + db_queries
+
+    def render(self):
+        """
+        The metrics in the Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            lines += [
+                "# HELP trivia_http_request_duration_seconds Time to handle a request.",
+                "# TYPE trivia_http_request_duration_seconds histogram"
+            ]
+            for (endpoint, method), histogram in sorted(self._latency.items()):
+                lines += self._histogram_lines(
+                    "trivia_http_request_duration_seconds", histogram, endpoint=endpoint, method=method
+                )
+
+            lines += [
+                "# HELP trivia_http_responses_total Responses sent, by status code.",
+                "# TYPE trivia_http_responses_total counter"
+            ]
+            for (endpoint, method, status), count in sorted(self._responses.items()):
+                lines.append(
+                    "trivia_http_responses_total" + _labels(endpoint=endpoint, method=method, status=status)
+                    + " " + str(count)
+                )
+
+            lines += [
+                "# HELP trivia_db_queries_total Database queries run by requests.",
+                "# TYPE trivia_db_queries_total counter"
+            ]
+            for endpoint, count in sorted(self._db_queries.items()):
+                lines.append("trivia_db_queries_total" + _labels(endpoint=endpoint) + " " + str(count))
+
+            lines += [
+                "# HELP trivia_db_request_duration_seconds Time a request spent in database queries.",
+                "# TYPE trivia_db_request_duration_seconds histogram"
+            ]
+            for endpoint, histogram in sorted(self._db_time.items()):
+                lines += self._histogram_lines("trivia_db_request_duration_seconds", histogram, endpoint=endpoint)
+
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _histogram_lines(name, histogram, **labels):
+        lines = [
+            name + "_bucket" + _labels(**labels, le=bound) + " " + str(count)
+            for bound, count in histogram.cumulative()
+        ]
+        lines.append(name + "_sum" + _labels(**labels) + " " + repr(histogram.sum))
+        lines.append(name + "_count" + _labels(**labels) + " " + str(histogram.count))
+        return lines
+
+
+# the start time is kept on the statement's execution context, which goes
+# away with it, so a statement that raises leaves nothing behind
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and has_request_context():
+        context._metrics_query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_metrics_query_started", None)
+    if started is not None and has_request_context():
+        g.db_seconds = g.get("db_seconds", 0.0) + time.perf_counter() - started
+        g.db_queries = g.get("db_queries", 0) + 1
+
+
+def init_metrics(app):
+    """
+    Record the app's requests, and add GET /metrics
+    """
+    if not app.config.get("METRICS_ENABLED", True):
+        return
+
+    metrics = RequestMetrics()
+    app.extensions["metrics"] = metrics
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+        g.db_queries = 0
+        g.db_seconds = 0.0
+
+    @app.after_request
+    def remember_status(response):
+        g.response_status = response.status_code
+        return response
+
+    # the request context stays until a streamed response is finished,
+    # so recording here includes the time spent streaming it
+    @app.teardown_request
+    def record_request(error=None):
+        started = g.pop("request_started", None)
+        if started is None:
+            return
+        metrics.record(
+            request.endpoint or UNMATCHED_ENDPOINT,
+            request.method,
+            g.pop("response_status", 500),
+            time.perf_counter() - started,
+            g.pop("db_queries", 0),
+            g.pop("db_seconds", 0.0)
+        )
+
+    @app.route("/metrics", methods=["GET"])
+    def get_metrics():
+        return Response(metrics.render(), content_type=PROMETHEUS_CONTENT_TYPE)
@@ -0,0 +1,122 @@
+"""
+Opaque pagination cursors
+"""
+
+import base64
+import binascii
+import json
+
+
+def encode_cursor(position):
+    """
+    Encode a dict describing a position in a result set
+    as an opaque, url-safe token.
+    """
+    raw = json.dumps(position, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token):
+    """
+    Decode a token made by encode_cursor.
+    Raises ValueError if the token is malformed.
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (TypeError, UnicodeError, binascii.Error, json.JSONDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+    if not isinstance(position, dict):
+        raise ValueError("Invalid cursor")
+
+    return position
+
+
+def get_after_id(args):
+    """
+    Read the keyset position from the request args.
+    Accepts either an opaque 'cursor' or a plain 'after_id'.
+    Returns None if neither is given (page mode).
+    Raises ValueError if the value is not usable.
+    """
+    if "cursor" in args:
+        after_id = decode_cursor(args["cursor"]).get("id")
+    elif "after_id" in args:
+        after_id = args["after_id"]
+    else:
+        return None
+
+    if isinstance(after_id, bool):
+        raise ValueError("Invalid cursor")
+
+    try:
+        after_id = int(after_id)
+    except TypeError as e:
+        raise ValueError("Invalid cursor") from e
+
+    if after_id < 0:
+        raise ValueError("Invalid cursor")
+
+    return after_id
+
+
+def next_id_cursor(rows, page_size):
+    """
+    Cursor for the page after 'rows' (formatted questions ordered by id),
+    or None if this was the last page.
+    """
+    if len(rows) < page_size:
+        return None
+    return encode_cursor({"id": rows[-1]["id"]})
+
+
+def get_offset(cursor):
+    """
+    Read the offset from a cursor made by next_offset_cursor.
+    A missing cursor means the first page.
+    Raises ValueError if the cursor is not usable.
+    """
+    if cursor is None:
+        return 0
+
+    if not isinstance(cursor, str):
+        raise ValueError("Invalid cursor")
+
+    offset = decode_cursor(cursor).get("offset")
+    if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+        raise ValueError("Invalid cursor")
+
+    return offset
+
+
+def next_offset_cursor(offset, page_length, total):
+    """
+    Cursor for the page after the one starting at 'offset',
+    or None if this was the last page.
+    """
+    if offset + page_length >= total or page_length == 0:
+        return None
+    return encode_cursor({"offset": offset + page_length})
+
+
+def get_limit(value, default, maximum):
+    """
+    Read a page size, capped at 'maximum'.
+    Raises ValueError if the value is not a positive integer.
+    """
+    if value is None:
+        return default
+
+    if isinstance(value, bool):
+        raise ValueError("Invalid limit")
+
+    try:
+        limit = int(value)
+    except TypeError as e:
+        raise ValueError("Invalid limit") from e
+
+    if limit < 1:
+        raise ValueError("Invalid limit")
+
+    return min(limit, maximum)
@@ -0,0 +1,66 @@
+"""
+Read replicas
+
+Views decorated with @read_only read from a replica when replicas are
+configured (DATABASE_REPLICA_URLS, see setup_db). Everything else uses
+the primary.
+
+Replicas lag behind the primary, so after a client writes, its reads go
+to the primary for READ_YOUR_WRITES_SECONDS. This is remembered in a
+cookie, so it works whichever worker serves the next request.
+"""
+
+import functools
+import time
+
+from flask import g, request
+
+READ_YOUR_WRITES_SECONDS = 5
+PRIMARY_COOKIE = "read_primary_until"
+
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def read_only(view):
+    """
+    Mark a view as only reading, so its queries can go to a replica
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.read_replica = True
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def _primary_until():
+    try:
+        return float(request.cookies.get(PRIMARY_COOKIE, 0))
+    except ValueError:
+        return 0
+
+
+def init_replicas(app):
+    window = app.config.get("READ_YOUR_WRITES_SECONDS", READ_YOUR_WRITES_SECONDS)
+
+    @app.before_request
+    def choose_database():
+        # g can outlive a request when an app context was pushed beforehand
+        g.read_replica = False
+        g.read_primary = time.time() < _primary_until()
+
+    if not app.config.get("DATABASE_REPLICA_URLS") or not window:
+        return
+
+    @app.after_request
+    def remember_write(response):
+        wrote = (
+            request.method not in READ_METHODS
+            and not g.get("read_replica", False)
+            and response.status_code < 400
+        )
+        if wrote:
+            response.set_cookie(
+                PRIMARY_COOKIE, str(time.time() + window), max_age=window, httponly=True, samesite="Lax"
+            )
+        return response
@@ -2,57 +2,92 @@
 Categories controller
 """
 
-from flask import abort, jsonify
-from models import Category, db
+from flask import request, abort, jsonify, current_app
+from models import question_counter, category_cache
+from queries import questions_page
 from werkzeug.exceptions import HTTPException
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from ..conditional import conditional
+from ..pagination import get_after_id, next_id_cursor
+from .questions import QUESTIONS_PER_PAGE
 
 
 def _abort(e):
     if isinstance(e, HTTPException):
         abort(e.code)
+    elif isinstance(e, PoolTimeoutError):
+        # every database connection is busy
+        abort(503)
     else:
+        current_app.logger.exception("Unhandled error in %s", request.endpoint)
         abort(500)
 
 
 def setup(app):
     """
     An endpoint to handle GET requests
-    for all available categories.
+    for all available categories,
+    with the number of questions in each.
     """
     @app.route("/categories", methods=["GET"])
+    @conditional
     def get_categories():
         try:
-            categories = Category.query.all()
-            categories_formatted = [cat.format() for cat in categories]
-            categories_hash = {
-                cat["id"]: cat["type"] for cat in categories_formatted
+            categories_hash = category_cache.get()
+
+            counts = question_counter.by_category()
+            question_counts = {
+                cat_id: counts.get(cat_id, 0) for cat_id in categories_hash
             }
 
             return jsonify({
                 "success": True,
-                "categories": categories_hash
+                "categories": categories_hash,
+                "question_counts": question_counts
             })
 
         except Exception as e:
             _abort(e)
 
     """
-    A GET endpoint to get questions based on category.
+    A GET endpoint to get questions based on category,
+    paginated like GET /questions: by page number (?page=N)
+    or by keyset (?cursor=<next_cursor> or ?after_id=<id>).
     """
     @app.route("/categories/<int:category_id>/questions", methods=["GET"])
+    @conditional
     def get_questions_for_category(category_id):
         try:
-            category = db.session.get(Category, category_id)
-
-            if category is None:
+            if category_id not in category_cache.get():
                 abort(404)
+
+            try:
+                after_id = get_after_id(request.args)
+            except ValueError:
+                abort(422)
+
+            if after_id is not None:
+                offset = 0
             else:
-                questions_formatted = [q.format() for q in category.questions]
+                page = request.args.get("page", 1, type=int)
+                offset = (max(page, 1) - 1) * QUESTIONS_PER_PAGE
 
-                return jsonify({
-                    "success": True,
-                    "questions": questions_formatted
-                })
+            # the page and the size of the category in one query
+            questions_formatted, total = questions_page(
+                QUESTIONS_PER_PAGE,
+                after_id=after_id,
+                offset=offset,
+                category_id=category_id,
+                with_total=True
+            )
+
+            return jsonify({
+                "success": True,
+                "questions": questions_formatted,
+                "total_questions": total,
+                "current_category": category_id,
+                "next_cursor": next_id_cursor(questions_formatted, QUESTIONS_PER_PAGE)
+            })
 
         except Exception as e:
             _abort(e)
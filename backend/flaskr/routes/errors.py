@@ -2,43 +2,59 @@
 Error controller
 """
 
-from flask import jsonify
+import json
+
+# the bodies never change, so serialize them once
+ERROR_MESSAGES = {
+    400: "Bad request",
+    404: "Resource not found",
+    405: "Method Not Allowed",
+    422: "Badly formatted request",
+    500: "Server error",
+    503: "Service unavailable"
+}
+
+# seconds, for the Retry-After header of 503 responses
+RETRY_AFTER_SECONDS = 1
+
+ERROR_BODIES = {
+    code: json.dumps({
+        "success": False,
+        "error": code,
+        "message": message
+    }).encode("utf-8")
+    for code, message in ERROR_MESSAGES.items()
+}
+
+
+def _error_response(app, code):
+    return app.response_class(ERROR_BODIES[code], status=code, mimetype="application/json")
 
 
 def setup(app):
 
+    @app.errorhandler(400)
+    def bad_request_error(error):
+        return _error_response(app, 400)
+
     @app.errorhandler(404)
     def not_found_error(error):
-        json = jsonify({
-            "success": False,
-            "error": 404,
-            "message": "Resource not found"
-        })
-        return (json, 404)
+        return _error_response(app, 404)
 
     @app.errorhandler(405)
     def not_allowed_error(error):
-        json = jsonify({
-            "success": False,
-            "error": 405,
-            "message": "Method Not Allowed"
-        })
-        return (json, 405)
+        return _error_response(app, 405)
 
     @app.errorhandler(422)
     def request_error(error):
-        json = jsonify({
-            "success": False,
-            "error": 422,
-            "message": "Badly formatted request"
-        })
-        return (json, 422)
+        return _error_response(app, 422)
 
     @app.errorhandler(500)
     def server_error(error):
-        json = jsonify({
-            "success": False,
-            "error": 500,
-            "message": "Server error"
-        })
-        return (json, 500)
+        return _error_response(app, 500)
+
+    @app.errorhandler(503)
+    def unavailable_error(error):
+        response = _error_response(app, 503)
+        response.headers["Retry-After"] = str(RETRY_AFTER_SECONDS)
+        return response
@@ -2,22 +2,142 @@
 Questions controller
 """
 
-from flask import request, abort
-from flask import jsonify
-from models import Question, Category, db
+import csv
+import io
+from flask import request, abort, current_app
+from flask import jsonify, Response, stream_with_context
+from models import Category, Question, db, question_counter, category_cache, question_search
+from queries import QUESTION_FIELDS, select_questions, questions_by_ids, questions_page
 from werkzeug.exceptions import HTTPException
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.exc import IntegrityError
+from ..conditional import conditional
+from ..replicas import read_only
+from ..pagination import (
+    get_after_id, next_id_cursor, get_limit, get_offset, next_offset_cursor
+)
 
 QUESTIONS_PER_PAGE = 10
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+BULK_BATCH_SIZE = 500
+EXPORT_BATCH_SIZE = 1000
+NDJSON_MIMETYPES = ("application/x-ndjson", "application/jsonl")
+BULK_ERROR_INVALID = "Badly formatted question"
+BULK_ERROR_CATEGORY = "Category does not exist"
+BULK_ERROR_DUPLICATE = "Duplicate question or answer in this upload"
+BULK_ERROR_EXISTS = "Question or answer already exists"
+BULK_DELETE_MAX_IDS = 1000
+
+EXPORT_MIMETYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
 
 
 def _abort(e):
     if isinstance(e, HTTPException):
         abort(e.code)
+    elif isinstance(e, PoolTimeoutError):
+        # every database connection is busy
+        abort(503)
     else:
+        current_app.logger.exception("Unhandled error in %s", request.endpoint)
         abort(500)
 
 
+def _read_bulk_rows():
+    """
+    Yields the (index, row) of a bulk upload, None for a line that is not
+    JSON. Blank lines are skipped but counted, so that the indexes are
+    the line numbers of the NDJSON, from 0.
+    """
+    if request.mimetype in NDJSON_MIMETYPES:
+        for i, line in enumerate(request.stream):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield i, current_app.json.loads(line)
+            except ValueError:
+                yield i, None
+
+    else:
+        data = request.get_json()
+        if not isinstance(data, list):
+            abort(422)
+        yield from enumerate(data)
+
+
+def _existing_categories(category_ids):
+    """
+    The ids in 'category_ids' of categories that exist in the database
+    """
+    category_ids = [category_id for category_id in category_ids if category_id is not None]
+    if not category_ids:
+        return set()
+    return set(db.session.scalars(db.select(Category.id).where(Category.id.in_(category_ids))))
+
+
+def _validate_bulk_row(row):
+    if not isinstance(row, dict):
+        return None
+    try:
+        return Question.get_validated_question(row)
+    except (AttributeError, TypeError):
+        # eg. a number where a string should be
+        return None
+
+
+def _delete_criteria(data):
+    """
+    The criteria of a bulk delete, from its "ids", "category" and
+    "difficulty". None if one is invalid or none is given, so that
+    a request cannot delete every question.
+    """
+    if not isinstance(data, dict):
+        return None
+
+    criteria = []
+    if "ids" in data:
+        ids = data["ids"]
+        if not isinstance(ids, list) or not ids or len(ids) > BULK_DELETE_MAX_IDS:
+            return None
+        if not all(isinstance(question_id, int) and not isinstance(question_id, bool) for question_id in ids):
+            return None
+        criteria.append(Question.id.in_(ids))
+
+    for field, column in (("category", Question.category), ("difficulty", Question.difficulty)):
+        if field in data:
+            try:
+                criteria.append(column == int(data[field]))
+            except (TypeError, ValueError):
+                return None
+
+    return criteria or None
+
+
+def _export_ndjson(query):
+    dumps = current_app.json.dumps
+    for rows in db.session.execute(query).partitions():
+        yield "".join(
+            dumps(dict(zip(QUESTION_FIELDS, row))) + "\n" for row in rows
+        )
+
+
+def _export_csv(query):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(QUESTION_FIELDS)
+
+    for rows in db.session.execute(query).partitions():
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    # header only, if there were no rows
+    yield buffer.getvalue()
+
+
 def setup(app):
 
     """
@@ -25,41 +145,88 @@ def setup(app):
     including pagination (every 10 questions).
     This endpoint should return a list of questions,
     number of total questions, current category, categories.
+    Pages can be requested by number (?page=N) or, for deep pages,
+    by keyset (?cursor=<next_cursor> or ?after_id=<id>) which seeks
+    on the primary key instead of scanning past N * 10 rows.
     """
 
     @app.route("/questions", methods=["GET"])
+    @conditional
     def get_questions():
         try:
-            page = request.args.get("page", 1, type=int)
-            offset = (page - 1) * QUESTIONS_PER_PAGE
-
-            query = (
-                Question.query
-                .offset(offset)
-                .limit(QUESTIONS_PER_PAGE)
-            )
-
-            questions = query.all()
-            questions_formatted = [ques.format() for ques in questions]
+            try:
+                after_id = get_after_id(request.args)
+            except ValueError:
+                abort(422)
 
-            categories = Category.query.all()
-            categories_formatted = [cat.format() for cat in categories]
+            if after_id is not None:
+                offset = 0
+            else:
+                page = request.args.get("page", 1, type=int)
+                offset = (max(page, 1) - 1) * QUESTIONS_PER_PAGE
 
-            # client expects a hash of categories
-            categories_hash = {
-                cat["id"]: cat["type"] for cat in categories_formatted
-            }
+            questions_formatted = questions_page(
+                QUESTIONS_PER_PAGE,
+                after_id=after_id,
+                offset=offset
+            )
 
             return jsonify({
                 "success": True,
                 "questions": questions_formatted,
-                "categories": categories_hash,
-                "total_questions": Question.query.count()
+                # client expects a hash of categories
+                "categories": category_cache.get(),
+                "total_questions": question_counter.total(),
+                "next_cursor": next_id_cursor(questions_formatted, QUESTIONS_PER_PAGE)
             })
 
         except Exception as e:
             _abort(e)
 
+    """
+    An endpoint to download the whole question bank,
+    optionally filtered by category and difficulty,
+    as NDJSON (default) or CSV (?format=csv).
+    The rows are streamed from a server-side cursor
+    so memory use does not grow with the size of the table.
+    """
+
+    @app.route("/questions/export", methods=["GET"])
+    @read_only
+    def export_questions():
+        try:
+            export_format = request.args.get("format", "ndjson")
+            if export_format not in EXPORT_MIMETYPES:
+                abort(422)
+
+            query = select_questions()
+
+            try:
+                if "category" in request.args:
+                    query = query.where(Question.category == int(request.args["category"]))
+                if "difficulty" in request.args:
+                    query = query.where(Question.difficulty == int(request.args["difficulty"]))
+            except ValueError:
+                abort(422)
+
+            query = query.execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+            if export_format == "csv":
+                chunks = _export_csv(query)
+            else:
+                chunks = _export_ndjson(query)
+
+            return Response(
+                stream_with_context(chunks),
+                mimetype=EXPORT_MIMETYPES[export_format],
+                headers={
+                    "Content-Disposition": "attachment; filename=questions." + export_format
+                }
+            )
+
+        except Exception as e:
+            _abort(e)
+
     """
     An endpoint to DELETE question using a question ID.
     """
@@ -68,21 +235,38 @@ def setup(app):
     def delete_question(question_id):
         try:
 
-            question = (
-                Question.query
-                .filter(Question.id == question_id)
-                .one_or_none()
-            )
-
-            if question is None:
+            if not Question.delete_by_id(question_id):
                 abort(404)
 
-            else:
-                question.delete()
+            return jsonify({
+                "success": True
+            })
 
-                return jsonify({
-                    "success": True
-                })
+        except Exception as e:
+            db.session.rollback()
+            _abort(e)
+
+    """
+    A DELETE endpoint to remove many questions in one statement,
+    eg. to clean up spam. The body has "ids" (up to BULK_DELETE_MAX_IDS)
+    and/or a "category" and "difficulty" to match. At least one is
+    required, and they must all match. Reports the ids actually deleted.
+    """
+    @app.route("/questions", methods=["DELETE"])
+    def delete_questions():
+        try:
+            criteria = _delete_criteria(request.get_json())
+
+            if criteria is None:
+                abort(422)
+
+            question_ids = sorted(Question.delete_where(*criteria))
+
+            return jsonify({
+                "success": True,
+                "deleted": len(question_ids),
+                "question_ids": question_ids
+            })
 
         except Exception as e:
             db.session.rollback()
@@ -119,13 +303,84 @@ def setup(app):
             db.session.rollback()
             _abort(e)
 
+    """
+    A POST endpoint to add many questions at once.
+    The body is either a JSON array of questions or NDJSON
+    (Content-Type: application/x-ndjson, one question per line),
+    which is read as it streams in. Each question is validated like
+    POST /questions and inserted in batches of BULK_BATCH_SIZE.
+    Bad rows are reported by index and do not stop the others.
+    """
+    @app.route("/questions/bulk", methods=["POST"])
+    def create_questions_bulk():
+        try:
+            question_ids = []
+            errors = []
+            batch = []
+            seen_questions = set()
+            seen_answers = set()
+            categories = category_cache.get()
+
+            def insert_batch():
+                new_ids = Question.insert_many([q for i, q in batch])
+                # a skipped question clashed with an existing one, unless its
+                # category was deleted since the upload was validated
+                categories_left = _existing_categories({
+                    q.category for (i, q), question_id in zip(batch, new_ids) if question_id is None
+                })
+                for (i, q), question_id in zip(batch, new_ids):
+                    if question_id is not None:
+                        question_ids.append(question_id)
+                    elif q.category is None or q.category in categories_left:
+                        errors.append({"row": i, "message": BULK_ERROR_EXISTS})
+                    else:
+                        errors.append({"row": i, "message": BULK_ERROR_CATEGORY})
+                batch.clear()
+
+            for i, row in _read_bulk_rows():
+                new_question = _validate_bulk_row(row)
+
+                if not new_question:
+                    errors.append({"row": i, "message": BULK_ERROR_INVALID})
+
+                elif new_question.category not in categories:
+                    errors.append({"row": i, "message": BULK_ERROR_CATEGORY})
+
+                elif new_question.question in seen_questions or new_question.answer in seen_answers:
+                    errors.append({"row": i, "message": BULK_ERROR_DUPLICATE})
+
+                else:
+                    seen_questions.add(new_question.question)
+                    seen_answers.add(new_question.answer)
+                    batch.append((i, new_question))
+                    if len(batch) >= BULK_BATCH_SIZE:
+                        insert_batch()
+
+            insert_batch()
+            errors.sort(key=lambda error: error["row"])
+
+            return jsonify({
+                "success": True,
+                "inserted": len(question_ids),
+                "question_ids": question_ids,
+                "errors": errors
+            })
+
+        except Exception as e:
+            db.session.rollback()
+            _abort(e)
+
     """
     A POST endpoint to get questions based on a search term.
-    It should return any questions for whom the search term
-    is a substring of the question.
+    It should return any questions in which every word of the
+    search term starts a word of the question, best match first.
+    Set "searchAnswers" to true to match the answer text as well.
+    Results are paginated: "limit" (capped at SEARCH_MAX_LIMIT)
+    and "cursor" (the next_cursor of the previous page).
     """
 
     @app.route("/questions/search", methods=["POST"])
+    @read_only
     def search_questions():
         try:
             data = request.get_json()
@@ -135,19 +390,29 @@ def setup(app):
 
             else:
                 search_term = data["searchTerm"].strip()
-                search_term_wildcard = "%" + search_term + "%"
+                search_answers = data.get("searchAnswers", False) is True
+
+                try:
+                    limit = get_limit(data.get("limit"), SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT)
+                    offset = get_offset(data.get("cursor"))
+                except ValueError:
+                    abort(422)
 
-                questions = (
-                    Question.query
-                    .filter(Question.question.ilike(search_term_wildcard))
-                    .all()
+                ids, total = question_search.search(
+                    search_term,
+                    search_answers,
+                    limit=limit,
+                    offset=offset
                 )
 
-                formatted_questions = [q.format() for q in questions]
+                # in ranked order
+                formatted_questions = questions_by_ids(ids)
 
                 return jsonify({
                     "success": True,
-                    "questions": formatted_questions
+                    "questions": formatted_questions,
+                    "total_matches": total,
+                    "next_cursor": next_offset_cursor(offset, len(ids), total)
                 })
 
         except Exception as e:
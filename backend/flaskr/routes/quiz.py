@@ -2,21 +2,114 @@
 Quiz controller
 """
 
-from flask import request, abort
+from flask import request, abort, current_app
 from flask import jsonify
-from sqlalchemy import func
-from models import Question
+from models import question_sampler, category_cache
+from queries import question_by_id, questions_by_ids, unseen_question
+from quiz_sessions import quiz_sessions, TTL_SECONDS, MAX_SESSIONS
 from werkzeug.exceptions import HTTPException
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from routing import reading_primary
+from ..replicas import read_only
+
+# draws to retry when the sampler returns an id that has been deleted
+MAX_STALE_DRAWS = 3
+
+DECK_DEFAULT_SIZE = 5
+DECK_MAX_SIZE = 50
 
 
 def _abort(e):
     if isinstance(e, HTTPException):
         abort(e.code)
+    elif isinstance(e, PoolTimeoutError):
+        # every database connection is busy
+        abort(503)
     else:
+        current_app.logger.exception("Unhandled error in %s", request.endpoint)
         abort(500)
 
 
+def _draw_question(quiz_category_id, seen):
+    """
+    Load a random question that is not in 'seen', by primary key.
+    Returns the formatted question, or None if there are none left.
+    """
+    reloaded = False
+    for _ in range(MAX_STALE_DRAWS):
+        question_id = question_sampler.draw(quiz_category_id, seen)
+        if question_id is None:
+            return None
+
+        question = question_by_id(question_id)
+        if question is not None:
+            return question
+
+        # the sampler's ids come from the primary, which a replica may be behind
+        with reading_primary():
+            question = question_by_id(question_id)
+        if question is not None:
+            return question
+
+        # deleted by another process since the ids were loaded,
+        # and likely not the only one
+        if reloaded:
+            question_sampler.removed(question_id)
+        else:
+            question_sampler.load()
+            reloaded = True
+
+    # the ids keep going stale, ask the database
+    with reading_primary():
+        return unseen_question(quiz_category_id, seen)
+
+
+def _get_quiz_category_id(data):
+    """
+    The optional quiz_category_id from a request body, as an int
+    """
+    quiz_category_id = data.get("quiz_category_id", None)
+
+    if quiz_category_id is not None:
+        try:
+            quiz_category_id = int(quiz_category_id)
+        except (TypeError, ValueError):
+            abort(422)
+
+    return quiz_category_id
+
+
+def _get_body():
+    """
+    The optional JSON object body of a request, 400 if it is something else
+    """
+    data = request.get_json(silent=True)
+    if data is None:
+        return {}
+    if not isinstance(data, dict):
+        abort(400)
+    return data
+
+
+def _get_seen(data):
+    """
+    The optional previous_questions from a request body, as a set
+    """
+    previous_questions = data.get("previous_questions", None)
+
+    if previous_questions is not None and isinstance(previous_questions, list):
+        return set(previous_questions)
+
+    return set()
+
+
 def setup(app):
+    quiz_sessions.configure(
+        app.config.get("QUIZ_SESSION_TTL_SECONDS", TTL_SECONDS),
+        app.config.get("QUIZ_SESSIONS_MAX", MAX_SESSIONS),
+        app.config.get("QUIZ_SESSION_DIR")
+    )
+
     """
     A POST endpoint to get questions to play the quiz.
     This endpoint should take category and previous question parameters
@@ -25,38 +118,121 @@ def setup(app):
     """
 
     @app.route("/quiz", methods=["POST"])
+    @read_only
     def get_quiz_question():
         data = request.get_json()
         try:
             # array of ids
-            previous_questions = data.get("previous_questions", None)
+            seen = _get_seen(data)
             # optional, can be None
-            quiz_category_id = data.get("quiz_category_id", None)
+            quiz_category_id = _get_quiz_category_id(data)
 
-            query = Question.query
+            question = _draw_question(quiz_category_id, seen)
 
-            if previous_questions is not None and isinstance(previous_questions, list) and len(previous_questions) >= 1:
-                query = query.filter(Question.id.notin_(previous_questions))
+            if question is None:
+                # Perhaps we have done all the questions. This is a success case.
+                return jsonify({
+                    "success": True,
+                    "question": None
+                })
 
-            if quiz_category_id is not None:
-                query = query.filter(Question.category == quiz_category_id)
+            else:
+                return jsonify({
+                    "success": True,
+                    "question": question
+                })
+
+        except Exception as e:
+            _abort(e)
+
+    """
+    A POST endpoint to start a quiz session.
+    The server remembers which questions the session has seen,
+    so the client does not need to send previous_questions.
+    Returns a token for the /quiz/sessions/<token>/next endpoint.
+    """
+
+    @app.route("/quiz/sessions", methods=["POST"])
+    @read_only
+    def create_quiz_session():
+        try:
+            data = _get_body()
+            # optional, can be None
+            quiz_category_id = _get_quiz_category_id(data)
+
+            if quiz_category_id is not None and quiz_category_id not in category_cache.get():
+                abort(404)
 
-            query = query.order_by(func.random())
-            question = query.first()
+            return jsonify({
+                "success": True,
+                "token": quiz_sessions.create(quiz_category_id),
+                "expires_in": quiz_sessions.ttl_seconds
+            })
+
+        except Exception as e:
+            _abort(e)
+
+    """
+    A POST endpoint to get the next question in a quiz session,
+    a random question that the session has not seen yet.
+    """
+
+    @app.route("/quiz/sessions/<token>/next", methods=["POST"])
+    @read_only
+    def get_quiz_session_question(token):
+        try:
+            session = quiz_sessions.get(token)
+
+            if session is None:
+                abort(404)
+
+            question = _draw_question(session.category_id, session.seen)
 
             if question is None:
-                # Perhaps we have done all the questions. This is a success case.
+                # all the questions have been done
                 return jsonify({
                     "success": True,
                     "question": None
                 })
 
             else:
+                session.mark_seen(question["id"])
+
                 return jsonify({
                     "success": True,
-                    "question": question.format()
+                    "question": question
                 })
 
         except Exception as e:
-            print(e, flush=True)
+            _abort(e)
+
+    """
+    A POST endpoint to get a whole round of the quiz at once:
+    a shuffled deck of distinct random questions within the given
+    category, if provided, that are not one of the previous questions.
+    The deck may be shorter than requested if there are not enough
+    questions left.
+    """
+
+    @app.route("/quiz/deck", methods=["POST"])
+    @read_only
+    def get_quiz_deck():
+        try:
+            data = _get_body()
+            seen = _get_seen(data)
+            quiz_category_id = _get_quiz_category_id(data)
+
+            size = data.get("size", DECK_DEFAULT_SIZE)
+            if not isinstance(size, int) or isinstance(size, bool) or size < 1:
+                abort(422)
+
+            ids = question_sampler.draw_many(min(size, DECK_MAX_SIZE), quiz_category_id, seen)
+
+            return jsonify({
+                "success": True,
+                # in the shuffled order
+                "questions": questions_by_ids(ids)
+            })
+
+        except Exception as e:
             _abort(e)
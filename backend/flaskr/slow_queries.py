@@ -0,0 +1,163 @@
+"""
+Slow query log
+
+Opt-in: set SLOW_QUERY_MS in the app config (or FLASK_SLOW_QUERY_MS) to log
+every statement that takes longer than that, with the route that ran it,
+its parameters and its query plan. The plan is taken right after the
+statement, on the same connection, with EXPLAIN (ANALYZE off) on Postgres
+and EXPLAIN QUERY PLAN on SQLite, so the statement is not run again.
+Statements on the read replicas are logged as well as the primary's.
+
+The last SLOW_QUERY_LOG_SIZE entries are kept in memory and can be read
+at GET /debug/slow-queries.
+"""
+
+from collections import deque
+import datetime
+import threading
+import time
+
+from flask import has_request_context, jsonify, request
+from sqlalchemy import event
+
+SLOW_QUERY_LOG_SIZE = 100
+
+# longest statement and parameters kept in an entry
+MAX_TEXT_LENGTH = 2000
+
+EXPLAIN_PREFIXES = {
+    "postgresql": "EXPLAIN (ANALYZE off) ",
+    "sqlite": "EXPLAIN QUERY PLAN "
+}
+
+# statements that can be explained without running them
+EXPLAINABLE = ("select", "insert", "update", "delete", "with")
+
+
+def _truncated(text):
+    if len(text) > MAX_TEXT_LENGTH:
+        return text[:MAX_TEXT_LENGTH] + "..."
+    return text
+
+
+class SlowQueryLog:
+    """
+    The most recent slow statements, oldest dropped first
+    """
+
+    def __init__(self, threshold_ms, size=SLOW_QUERY_LOG_SIZE, explain=True):
+        self.threshold = threshold_ms / 1000
+        self.explain = explain
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, entry):
+        with self._lock:
+            self._entries.append(entry)
+
+    def entries(self):
+        """
+        The entries, newest first
+        """
+        with self._lock:
+            return list(reversed(self._entries))
+
+
+def _route():
+    if not has_request_context():
+        return None
+    rule = request.url_rule.rule if request.url_rule is not None else request.path
+    return request.method + " " + rule
+
+
+def _explain(conn, statement, parameters):
+    """
+    The plan of the statement, as a list of lines, or None if it
+    cannot be explained
+    """
+    prefix = EXPLAIN_PREFIXES.get(conn.dialect.name)
+    if prefix is None or not statement.lstrip().lower().startswith(EXPLAINABLE):
+        return None
+
+    cursor = conn.connection.cursor()
+    # an error would abort the request's transaction on Postgres
+    savepoint = conn.dialect.name == "postgresql"
+    try:
+        if savepoint:
+            cursor.execute("SAVEPOINT slow_query_explain")
+        try:
+            cursor.execute(prefix + statement, parameters)
+            plan = [str(row[-1]) for row in cursor.fetchall()]
+        except Exception:
+            if savepoint:
+                cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+            return None
+        if savepoint:
+            cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+        return plan
+    finally:
+        cursor.close()
+
+
+def init_slow_queries(app, db):
+    """
+    Record the app's slow statements if SLOW_QUERY_MS is set, and add
+    GET /debug/slow-queries
+    """
+    threshold_ms = app.config.get("SLOW_QUERY_MS")
+    if not threshold_ms:
+        return
+
+    with app.app_context():
+        # the primary and the replicas, which serve the @read_only views
+        engines = list(db.engines.values())
+
+    log = SlowQueryLog(
+        float(threshold_ms),
+        size=app.config.get("SLOW_QUERY_LOG_SIZE", SLOW_QUERY_LOG_SIZE),
+        explain=app.config.get("SLOW_QUERY_EXPLAIN", True)
+    )
+    app.extensions["slow_queries"] = log
+
+    # on the statement's execution context, so that nothing is left
+    # behind when the statement raises
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._slow_query_started = time.perf_counter()
+
+    def check_duration(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_slow_query_started", None)
+        if started is None:
+            return
+        seconds = time.perf_counter() - started
+        if seconds < log.threshold:
+            return
+
+        entry = {
+            "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "duration_ms": round(seconds * 1000, 3),
+            "route": _route(),
+            "statement": _truncated(statement),
+            "parameters": _truncated(repr(parameters)),
+            "plan": None
+        }
+        # the parameters of an executemany are for many statements
+        if log.explain and not executemany:
+            entry["plan"] = _explain(conn, statement, parameters)
+
+        log.add(entry)
+        app.logger.warning(
+            "Slow query (%.1f ms) in %s: %s", entry["duration_ms"], entry["route"], entry["statement"]
+        )
+
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", start_timer)
+        event.listen(engine, "after_cursor_execute", check_duration)
+
+    @app.route("/debug/slow-queries", methods=["GET"])
+    def get_slow_queries():
+        return jsonify({
+            "success": True,
+            "threshold_ms": log.threshold * 1000,
+            "slow_queries": log.entries()
+        })
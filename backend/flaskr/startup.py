@@ -0,0 +1,115 @@
+"""
+Startup modes and boot timing
+
+In the "development" mode (the default) create_app pushes an app context
+and creates any missing tables, as it always has. The "production" mode
+does neither, the schema is left to the migrations, and can instead check
+once that the database is at the latest migration (SCHEMA_CHECK).
+
+Both are set in the app config, or from FLASK_ prefixed environment
+variables, eg. FLASK_STARTUP_MODE=production FLASK_SCHEMA_CHECK=true
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import click
+
+STARTUP_MODES = ("development", "production")
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MIGRATIONS_DIR = os.path.join(BACKEND_DIR, "migrations")
+
+STARTUP_TIME_RUNS = 5
+
+# run in a fresh interpreter, so that nothing is imported yet
+_MEASURE_STARTUP = """
+import time
+started = time.perf_counter()
+import flaskr
+imported = time.perf_counter()
+app = flaskr.create_app()
+print(imported - started, app.extensions["startup"]["boot_seconds"])
+"""
+
+
+def get_startup_mode(app):
+    mode = app.config.get("STARTUP_MODE", "development")
+    if mode not in STARTUP_MODES:
+        raise ValueError("Unknown startup mode: " + str(mode))
+    return mode
+
+
+def migration_scripts():
+    """
+    The alembic ScriptDirectory of the migrations
+    """
+    # only needed when checking the schema, and slow to import
+    from alembic.config import Config
+    from alembic.script import ScriptDirectory
+
+    config = Config()
+    config.set_main_option("script_location", MIGRATIONS_DIR)
+    return ScriptDirectory.from_config(config)
+
+
+def check_schema(app, db):
+    """
+    Raise RuntimeError unless the database is at the latest migration
+    """
+    from alembic.runtime.migration import MigrationContext
+
+    expected = set(migration_scripts().get_heads())
+
+    with app.app_context():
+        with db.engine.connect() as connection:
+            current = set(MigrationContext.configure(connection).get_current_heads())
+
+    if current != expected:
+        raise RuntimeError(
+            "Database schema is at " + (", ".join(sorted(current)) or "no revision")
+            + ", expected " + ", ".join(sorted(expected)) + ". Run 'flask db upgrade'."
+        )
+
+
+def record_boot_time(app, started):
+    """
+    Store and log the seconds create_app took, from 'started' (perf_counter)
+    """
+    boot_seconds = time.perf_counter() - started
+    app.extensions["startup"] = {
+        "mode": get_startup_mode(app),
+        "boot_seconds": boot_seconds
+    }
+    app.logger.info("create_app took %.1f ms", boot_seconds * 1000)
+
+
+@click.command("startup-time")
+@click.option("--runs", default=STARTUP_TIME_RUNS, show_default=True, help="Number of fresh processes to time.")
+def startup_time_command(runs):
+    """
+    Time importing flaskr and running create_app in fresh processes.
+    The startup mode and other settings are taken from the environment.
+    """
+    import_times = []
+    boot_times = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", _MEASURE_STARTUP],
+            cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout
+        import_seconds, boot_seconds = output.split()[-2:]
+        import_times.append(float(import_seconds) * 1000)
+        boot_times.append(float(boot_seconds) * 1000)
+
+    for name, times in (("import", import_times), ("create_app", boot_times)):
+        click.echo("%-10s median %7.1f ms  min %7.1f ms  max %7.1f ms" % (
+            name, statistics.median(times), min(times), max(times)
+        ))
+
+
+def init_startup(app):
+    app.cli.add_command(startup_time_command)
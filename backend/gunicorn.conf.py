@@ -0,0 +1,60 @@
+"""
+gunicorn settings, read by `gunicorn wsgi:app` from the backend directory
+
+The app is made once, before the workers are forked, so that they share
+its memory (copy-on-write) and boot at once. Each worker keeps its own
+caches. They share the data version through a file (DATA_VERSION_FILE),
+so that a write in one worker makes the others reload theirs, and the
+quiz sessions through a directory (QUIZ_SESSION_DIR), so that any worker
+can serve the next question of a session.
+"""
+
+import os
+import shutil
+import tempfile
+
+from models import dispose_engines
+
+
+def _cpu_count():
+    try:
+        # the CPUs this process may use, eg. in a container
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", _cpu_count() * 2 + 1))
+preload_app = True
+
+# the migrations manage the schema, see README
+os.environ.setdefault("FLASK_STARTUP_MODE", "production")
+
+_own_version_file = "FLASK_DATA_VERSION_FILE" not in os.environ
+if _own_version_file:
+    fd, path = tempfile.mkstemp(prefix="trivia-data-version-")
+    os.close(fd)
+    os.environ["FLASK_DATA_VERSION_FILE"] = path
+
+_own_session_dir = "FLASK_QUIZ_SESSION_DIR" not in os.environ
+if _own_session_dir:
+    os.environ["FLASK_QUIZ_SESSION_DIR"] = tempfile.mkdtemp(prefix="trivia-quiz-sessions-")
+
+
+def post_fork(server, worker):
+    # connections opened before the fork (eg. by FLASK_SCHEMA_CHECK) belong
+    # to the master, the worker opens its own
+    dispose_engines(server.app.wsgi(), close=False)
+
+
+def on_exit(server):
+    if _own_version_file:
+        path = os.environ["FLASK_DATA_VERSION_FILE"]
+        for leftover in (path, path + ".lock"):
+            try:
+                os.remove(leftover)
+            except FileNotFoundError:
+                pass
+    if _own_session_dir:
+        shutil.rmtree(os.environ["FLASK_QUIZ_SESSION_DIR"], ignore_errors=True)
@@ -0,0 +1,109 @@
+"""indexes on category, hash-based uniqueness for question and answer
+
+Revision ID: 194b5e8e8348
+Revises: 26307169f204
+Create Date: 2026-10-18 14:05:37.902415
+
+Adds (category, id) and (category, difficulty) indexes for the quiz,
+category and export filters.
+
+Replaces the unique constraints on the full question and answer text
+with unique md5 hash columns, which are much smaller to index.
+Databases loaded from trivia.psql never had the text constraints,
+so on Postgres they are dropped only if they exist. On SQLite they are
+unnamed, and are dropped by the batch that already rebuilds the table
+to make the hash columns NOT NULL, under the names that the naming
+convention gives the reflected constraints.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import hashlib
+
+
+# revision identifiers, used by Alembic.
+revision = '194b5e8e8348'
+down_revision = '26307169f204'
+branch_labels = None
+depends_on = None
+
+
+# names for the unnamed SQLite unique constraints, see batch_alter_table
+NAMING_CONVENTION = {"uq": "uq_%(table_name)s_%(column_0_name)s"}
+
+
+def _backfill_hashes(bind):
+    if bind.dialect.name == 'postgresql':
+        op.execute("UPDATE questions SET question_hash = md5(question), answer_hash = md5(answer)")
+        return
+
+    questions = sa.table(
+        'questions',
+        sa.column('id', sa.Integer),
+        sa.column('question', sa.String),
+        sa.column('answer', sa.String),
+        sa.column('question_hash', sa.String),
+        sa.column('answer_hash', sa.String)
+    )
+
+    def md5(text):
+        return hashlib.md5(text.encode('utf-8'), usedforsecurity=False).hexdigest()
+
+    rows = bind.execute(sa.select(questions.c.id, questions.c.question, questions.c.answer)).all()
+    for question_id, question, answer in rows:
+        bind.execute(
+            questions.update()
+            .where(questions.c.id == question_id)
+            .values(question_hash=md5(question), answer_hash=md5(answer))
+        )
+
+
+def upgrade():
+    bind = op.get_bind()
+
+    op.create_index('ix_questions_category_id', 'questions', ['category', 'id'])
+    op.create_index(
+        'ix_questions_category_difficulty',
+        'questions',
+        ['category', 'difficulty'],
+        postgresql_include=['id']
+    )
+
+    op.add_column('questions', sa.Column('question_hash', sa.String(length=32), nullable=True))
+    op.add_column('questions', sa.Column('answer_hash', sa.String(length=32), nullable=True))
+    _backfill_hashes(bind)
+
+    with op.batch_alter_table('questions', naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.alter_column('question_hash', existing_type=sa.String(length=32), nullable=False)
+        batch_op.alter_column('answer_hash', existing_type=sa.String(length=32), nullable=False)
+        if bind.dialect.name == 'sqlite':
+            batch_op.drop_constraint('uq_questions_question', type_='unique')
+            batch_op.drop_constraint('uq_questions_answer', type_='unique')
+
+    op.create_index('ix_questions_question_hash', 'questions', ['question_hash'], unique=True)
+    op.create_index('ix_questions_answer_hash', 'questions', ['answer_hash'], unique=True)
+
+    if bind.dialect.name == 'postgresql':
+        op.execute("ALTER TABLE questions DROP CONSTRAINT IF EXISTS questions_question_key")
+        op.execute("ALTER TABLE questions DROP CONSTRAINT IF EXISTS questions_answer_key")
+
+
+def downgrade():
+    bind = op.get_bind()
+
+    if bind.dialect.name == 'postgresql':
+        op.create_unique_constraint('questions_question_key', 'questions', ['question'])
+        op.create_unique_constraint('questions_answer_key', 'questions', ['answer'])
+
+    op.drop_index('ix_questions_answer_hash', table_name='questions')
+    op.drop_index('ix_questions_question_hash', table_name='questions')
+
+    with op.batch_alter_table('questions') as batch_op:
+        batch_op.drop_column('answer_hash')
+        batch_op.drop_column('question_hash')
+        if bind.dialect.name == 'sqlite':
+            batch_op.create_unique_constraint('uq_questions_question', ['question'])
+            batch_op.create_unique_constraint('uq_questions_answer', ['answer'])
+
+    op.drop_index('ix_questions_category_difficulty', table_name='questions')
+    op.drop_index('ix_questions_category_id', table_name='questions')
@@ -0,0 +1,48 @@
+"""full-text search column and GIN index on questions
+
+Revision ID: 26307169f204
+Revises: 7f156709a72a
+Create Date: 2026-10-18 09:40:02.118760
+
+Postgres only. The question text is weighted 'A' and the answer 'B',
+so a tsquery can be restricted to the question with the :A label.
+The 'simple' configuration is used (no stemming or stop words) so that
+searches for words such as "which" still match, as they did with ILIKE.
+Other databases use the in-memory index in search.py instead.
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '26307169f204'
+down_revision = '7f156709a72a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute("""
+        ALTER TABLE questions ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('simple', coalesce(question, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce(answer, '')), 'B')
+        ) STORED
+    """)
+    op.create_index(
+        'ix_questions_search_vector',
+        'questions',
+        ['search_vector'],
+        postgresql_using='gin'
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.drop_index('ix_questions_search_vector', table_name='questions')
+    op.drop_column('questions', 'search_vector')
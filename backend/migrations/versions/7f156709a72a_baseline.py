@@ -0,0 +1,46 @@
+"""baseline schema: categories and questions
+
+Revision ID: 7f156709a72a
+Revises:
+Create Date: 2026-10-18 09:12:41.503214
+
+Databases loaded from trivia.psql already have these tables,
+stamp them with "flask db stamp 7f156709a72a" instead of running this.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7f156709a72a'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'categories',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('type', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('type')
+    )
+    op.create_table(
+        'questions',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('question', sa.String(), nullable=False),
+        sa.Column('answer', sa.String(), nullable=False),
+        sa.Column('difficulty', sa.Integer(), nullable=False),
+        sa.Column('category', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['category'], ['categories.id'], onupdate='CASCADE', ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('answer'),
+        sa.UniqueConstraint('question')
+    )
+
+
+def downgrade():
+    op.drop_table('questions')
+    op.drop_table('categories')
@@ -1,6 +1,16 @@
-from sqlalchemy import Column, String, Integer, ForeignKey
+from sqlalchemy import Column, String, Integer, ForeignKey, Index, delete, func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import validates
 from flask_sqlalchemy import SQLAlchemy
 from dotenv import load_dotenv
+from counters import QuestionCounter, RESYNC_SECONDS as COUNT_RESYNC_SECONDS
+from category_cache import CategoryCache
+from search import QuestionSearch
+from sampler import QuestionSampler, RESYNC_SECONDS as SAMPLER_RESYNC_SECONDS
+from data_version import data_version
+from routing import RoutingSession, reading_primary, replica_bind_key
+import hashlib
 import os
 
 load_dotenv()
@@ -8,32 +18,185 @@ load_dotenv()
 PGPASSWORD = os.getenv("PGPASSWORD")
 PGUSER = os.getenv("PGUSER")
 
-default_uri = 'postgresql://' + PGUSER + ':' + PGPASSWORD + '@localhost:5432/trivia'
+default_uri = os.getenv("DATABASE_URL") or (
+    'postgresql://' + PGUSER + ':' + PGPASSWORD + '@localhost:5432/trivia'
+)
+
+# comma separated, for the read-only routes
+default_replica_uris = os.getenv("DATABASE_REPLICA_URLS", "")
+
+# connection pool defaults, see engine_options
+DB_POOL_SIZE = 5
+DB_MAX_OVERFLOW = 10
+# fail fast when every connection is busy, the routes answer 503
+DB_POOL_TIMEOUT = 5
+DB_POOL_RECYCLE = 1800
+# costs a round trip per checkout, turn on if idle connections get dropped
+DB_POOL_PRE_PING = False
+
+# deleting more questions than this at once reloads the search index and
+# the quiz sampler, rather than removing the questions from them one by one
+REMOVED_REBUILD_THRESHOLD = 100
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+"""
+engine_options(config, database_path)
+    the SQLAlchemy engine options for the database, from the DB_ config keys:
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT (seconds), DB_POOL_RECYCLE (seconds),
+    DB_POOL_PRE_PING and DB_STATEMENT_TIMEOUT_MS (Postgres only, off by default).
+    Options already in SQLALCHEMY_ENGINE_OPTIONS take precedence.
+"""
+
+
+def engine_options(config, database_path):
+    url = make_url(database_path)
+    options = {
+        "pool_recycle": config.get("DB_POOL_RECYCLE", DB_POOL_RECYCLE),
+        "pool_pre_ping": config.get("DB_POOL_PRE_PING", DB_POOL_PRE_PING)
+    }
+
+    # an in-memory SQLite database has a connection per thread, not a sized pool
+    in_memory = url.database in (None, "", ":memory:") or url.query.get("mode") == "memory"
+    if not (url.get_backend_name() == "sqlite" and in_memory):
+        options["pool_size"] = config.get("DB_POOL_SIZE", DB_POOL_SIZE)
+        options["max_overflow"] = config.get("DB_MAX_OVERFLOW", DB_MAX_OVERFLOW)
+        options["pool_timeout"] = config.get("DB_POOL_TIMEOUT", DB_POOL_TIMEOUT)
+
+    statement_timeout = config.get("DB_STATEMENT_TIMEOUT_MS")
+    if statement_timeout and url.get_backend_name() == "postgresql":
+        if url.get_driver_name() == "asyncpg":
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(int(statement_timeout))}}
+        else:
+            options["connect_args"] = {"options": "-c statement_timeout=" + str(int(statement_timeout))}
+
+    options.update(config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    return options
+
+
+"""
+async_url(database_path)
+    the URL with the async driver of its database, for ASYNC_ENGINES
+"""
+
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+
+def async_url(database_path):
+    url = make_url(database_path)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError("No async driver for " + backend)
+    url = url.set(drivername=backend + "+" + ASYNC_DRIVERS[backend])
+    return url.render_as_string(hide_password=False)
 
-db = SQLAlchemy()
 
 """
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    each of DATABASE_REPLICA_URLS gets a bind, which read-only requests use (see routing.py)
+    with ASYNC_ENGINES, the engines use the async drivers, for the ASGI server (see flaskr/asgi.py)
+    with DATA_VERSION_FILE, the data version is shared through that file, see sync_caches
+    if create_schema, pushes an app context and creates any missing tables,
+    which is handy for the dev server and the tests but costs a round trip
+    per table on every start. Production uses the migrations instead.
 """
 
 
-def setup_db(app, database_path=default_uri):
+def setup_db(app, database_path=default_uri, create_schema=True):
+    replica_uris = app.config.get("DATABASE_REPLICA_URLS", default_replica_uris)
+    if isinstance(replica_uris, str):
+        replica_uris = [uri.strip() for uri in replica_uris.split(",") if uri.strip()]
+
+    if app.config.get("ASYNC_ENGINES", False):
+        database_path = async_url(database_path)
+        replica_uris = [async_url(uri) for uri in replica_uris]
+
+    binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+    for i, uri in enumerate(replica_uris):
+        binds[replica_bind_key(i)] = dict(engine_options(app.config, uri), url=uri)
+
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-    app.config["DEBUG"] = True
-    app.app_context().push()
-    db.app = app
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config, database_path)
+    app.config["SQLALCHEMY_BINDS"] = binds
+    app.config["DATABASE_REPLICA_URLS"] = replica_uris
     db.init_app(app)
-    db.create_all()
+    if create_schema:
+        app.app_context().push()
+        db.create_all()
+    question_counter.configure(
+        app.config.get("QUESTION_COUNT_RESYNC_SECONDS", COUNT_RESYNC_SECONDS)
+    )
+    question_counter.invalidate()
+    category_cache.bump()
+    data_version.share(app.config.get("DATA_VERSION_FILE"))
+    data_version.reset()
+    question_search.configure(app.config.get("SEARCH_BACKEND", "auto"))
+    question_sampler.configure(
+        app.config.get("QUIZ_SAMPLER_RESYNC_SECONDS", SAMPLER_RESYNC_SECONDS)
+    )
+    question_sampler.invalidate()
+
+
+"""
+sync_caches()
+    drops the in-process caches if another process wrote since the last call,
+    when the data version is shared between worker processes (DATA_VERSION_FILE).
+    Returns the data version it checked, which the caches are at least as new as
+"""
+
+
+def sync_caches():
+    version, changed = data_version.refresh()
+    if changed:
+        question_counter.invalidate()
+        category_cache.bump()
+        question_search.invalidate()
+        question_sampler.invalidate()
+    return version
+
+
+"""
+dispose_engines(app)
+    closes the pooled connections of the app's engines. A forked worker
+    passes close=False, to drop the ones it inherited without closing
+    them under the parent
+"""
+
+
+def dispose_engines(app, close=True):
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=close)
+
+
+"""
+text_hash(text)
+    the md5 hex digest of the text, the same as md5(text) in Postgres
+"""
+
+
+def text_hash(text):
+    return hashlib.md5(text.encode('utf-8'), usedforsecurity=False).hexdigest()
 
 
 class Question(db.Model):
     __tablename__ = 'questions'
+    __table_args__ = (
+        # quiz draws, category pages and counts
+        Index('ix_questions_category_id', 'category', 'id'),
+        # category and difficulty filters, eg. the export
+        Index('ix_questions_category_difficulty', 'category', 'difficulty', postgresql_include=['id']),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    question = Column(String, unique=True, nullable=False)
-    answer = Column(String, unique=True, nullable=False)
+    question = Column(String, nullable=False)
+    answer = Column(String, nullable=False)
+    # uniqueness is enforced on short hashes rather than the full text,
+    # with unique indexes, as migration 194b5e8e8348 makes them
+    question_hash = Column(String(32), nullable=False, unique=True, index=True)
+    answer_hash = Column(String(32), nullable=False, unique=True, index=True)
     difficulty = Column(Integer, nullable=False)
     category = db.Column(db.Integer, ForeignKey('categories.id', ondelete='SET NULL', onupdate='CASCADE'))
     backref = db.backref('questions', cascade="all, delete-orphan", lazy=True)
@@ -45,16 +208,100 @@ class Question(db.Model):
         self.category = category
         self.difficulty = difficulty
 
+    @validates('question', 'answer')
+    def _set_hash(self, key, value):
+        setattr(self, key + '_hash', text_hash(value))
+        return value
+
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        _questions_added([(self.id, self.question, self.answer, self.category)])
 
     def update(self):
         db.session.commit()
+        # the category may have changed
+        question_counter.invalidate()
+        data_version.bump()
+        question_search.added(self.id, self.question, self.answer)
+        question_sampler.added(self.id, self.category)
 
     def delete(self):
+        question_id = self.id
+        category_id = self.category
         db.session.delete(self)
         db.session.commit()
+        _questions_removed([(question_id, category_id)])
+
+    """
+    insert_many(questions)
+        inserts a batch of new (unsaved) questions in one statement
+        and commits. Questions whose text or answer already exists are
+        skipped. Returns the new ids in the same order as 'questions',
+        with None for the skipped ones.
+    """
+    @staticmethod
+    def insert_many(questions):
+        if not questions:
+            return []
+
+        rows = [
+            {
+                'question': q.question,
+                'answer': q.answer,
+                'question_hash': q.question_hash,
+                'answer_hash': q.answer_hash,
+                'category': q.category,
+                'difficulty': q.difficulty
+            }
+            for q in questions
+        ]
+
+        ids = _insert_rows(questions, rows)
+        # one version bump for the batch
+        _questions_added([
+            (question_id, row['question'], row['answer'], row['category'])
+            for question_id, row in zip(ids, rows)
+            if question_id is not None
+        ])
+        return ids
+
+    """
+    delete_by_id(question_id)
+        deletes the question in one DELETE ... RETURNING statement,
+        without loading it first, and commits. Returns False if there
+        was no such question.
+    """
+    @staticmethod
+    def delete_by_id(question_id):
+        return bool(Question.delete_where(Question.id == question_id))
+
+    """
+    delete_where(*criteria)
+        deletes the questions matching all of 'criteria' in one statement
+        and commits. Returns the ids of the deleted questions.
+    """
+    @staticmethod
+    def delete_where(*criteria):
+        if db.session.get_bind().dialect.delete_returning:
+            statement = (
+                delete(Question.__table__)
+                .where(*criteria)
+                .returning(Question.id, Question.category)
+            )
+            rows = db.session.execute(statement).all()
+        else:
+            rows = db.session.execute(
+                select(Question.id, Question.category).where(*criteria).with_for_update()
+            ).all()
+            if rows:
+                db.session.execute(
+                    delete(Question.__table__).where(Question.id.in_([row[0] for row in rows]))
+                )
+        db.session.commit()
+
+        _questions_removed(rows)
+        return [question_id for question_id, _ in rows]
 
     def format(self):
         return {
@@ -94,6 +341,90 @@ class Question(db.Model):
             return None
 
 
+def _insert_rows(questions, rows):
+    """
+    Insert the rows of the questions and commit, returns the new ids
+    in the same order, with None for the rows that were skipped
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return [_insert_or_skip(q) for q in questions]
+
+    # one multi-row INSERT ... ON CONFLICT DO NOTHING RETURNING
+    statement = (
+        insert(Question.__table__)
+        .on_conflict_do_nothing()
+        .returning(Question.id, Question.question)
+    )
+    try:
+        inserted = dict(
+            (text, question_id)
+            for question_id, text in db.session.execute(statement, rows)
+        )
+        db.session.commit()
+    except IntegrityError:
+        # eg. a category deleted since the rows were validated,
+        # find the bad rows one at a time
+        db.session.rollback()
+        return [_insert_or_skip(q) for q in questions]
+
+    return [inserted.get(row['question']) for row in rows]
+
+
+def _insert_or_skip(question):
+    """
+    Insert one question in a savepoint, returns its id
+    or None if it clashes with an existing question
+    """
+    try:
+        with db.session.begin_nested():
+            db.session.add(question)
+        db.session.commit()
+    except IntegrityError:
+        return None
+
+    return question.id
+
+
+def _questions_added(rows):
+    """
+    rows are the (id, question, answer, category_id) of new questions
+    """
+    if not rows:
+        return
+
+    data_version.bump()
+    for question_id, question, answer, category_id in rows:
+        question_counter.added(category_id)
+        question_search.added(question_id, question, answer)
+        question_sampler.added(question_id, category_id)
+
+
+def _questions_removed(rows):
+    """
+    rows are the (id, category_id) of deleted questions
+    """
+    if not rows:
+        return
+
+    data_version.bump()
+    for question_id, category_id in rows:
+        question_counter.removed(category_id)
+
+    if len(rows) > REMOVED_REBUILD_THRESHOLD:
+        # each removal scans the index and the sampler, rebuild them instead
+        question_search.invalidate()
+        question_sampler.invalidate()
+    else:
+        for question_id, _ in rows:
+            question_search.removed(question_id)
+            question_sampler.removed(question_id)
+
+
 """
 Category
 """
@@ -108,8 +439,114 @@ class Category(db.Model):
     def __init__(self, type):
         self.type = type
 
+    def insert(self):
+        db.session.add(self)
+        db.session.commit()
+        category_cache.bump()
+        data_version.bump()
+
+    def update(self):
+        db.session.commit()
+        category_cache.bump()
+        data_version.bump()
+
+    def delete(self):
+        # deletes the category's questions too (see Question.backref)
+        category_id = self.id
+        db.session.delete(self)
+        db.session.commit()
+        category_cache.bump()
+        data_version.bump()
+        question_counter.category_removed(category_id)
+        question_search.invalidate()
+        question_sampler.invalidate()
+
     def format(self):
         return {
             'id': self.id,
             'type': self.type
         }
+
+
+"""
+question_counter
+    total and per-category question counts, kept up to date by the
+    write methods above
+"""
+
+
+def _load(statement, session=None):
+    """
+    The rows of a cache loader's statement, always read from the primary:
+    the caches are kept under the data version, which a lagging replica
+    would not match, and a stale cache is only reloaded after the next write
+    """
+    session = session or db.session
+    with reading_primary():
+        return session.execute(statement).all()
+
+
+def _count_questions_by_category(session=None):
+    return _load(
+        db.select(Question.category, func.count(Question.id))
+        .group_by(Question.category),
+        session
+    )
+
+
+question_counter = QuestionCounter(_count_questions_by_category)
+
+
+"""
+category_cache
+    the {id: type} map of categories, reloaded after any write
+    through the Category methods above
+"""
+
+
+def _load_categories(session=None):
+    return _load(
+        db.select(Category.id, Category.type).order_by(Category.id),
+        session
+    )
+
+
+category_cache = CategoryCache(_load_categories)
+
+
+"""
+question_search
+    full-text search over questions (and optionally answers),
+    see search.py
+"""
+
+
+def _load_question_text(session=None):
+    return _load(
+        db.select(Question.id, Question.question, Question.answer),
+        session
+    )
+
+
+question_search = QuestionSearch(
+    Question.__table__,
+    _load_question_text,
+    lambda: db.session
+)
+
+
+"""
+question_sampler
+    arrays of question ids per category, for picking
+    a random quiz question
+"""
+
+
+def _load_question_categories(session=None):
+    return _load(
+        db.select(Question.id, Question.category),
+        session
+    )
+
+
+question_sampler = QuestionSampler(_load_question_categories)
@@ -0,0 +1,117 @@
+"""
+Read-only queries
+
+The read endpoints only need question rows as dicts, so these
+run Core selects of the exact columns on the session's connection
+and build the dicts straight from the row tuples. No ORM objects are
+constructed, and nothing is added to the session's identity map.
+
+Writes still go through the model methods in models.py.
+"""
+
+from sqlalchemy import func, select
+from models import Question, db
+
+questions = Question.__table__
+
+QUESTION_FIELDS = ("id", "question", "answer", "category", "difficulty")
+QUESTION_COLUMNS = tuple(questions.c[field] for field in QUESTION_FIELDS)
+
+
+def _execute(statement, session=None):
+    session = session or db.session
+    return session.connection().execute(statement)
+
+
+def _formatted(rows):
+    return [dict(zip(QUESTION_FIELDS, row)) for row in rows]
+
+
+def select_questions():
+    """
+    A select of the question columns, ordered by id, for adding filters to
+    """
+    return select(*QUESTION_COLUMNS).order_by(questions.c.id)
+
+
+def question_by_id(question_id, session=None):
+    """
+    The formatted question, or None if it does not exist
+    """
+    row = _execute(
+        select(*QUESTION_COLUMNS).where(questions.c.id == question_id),
+        session
+    ).first()
+
+    return None if row is None else dict(zip(QUESTION_FIELDS, row))
+
+
+def questions_by_ids(ids, session=None):
+    """
+    The formatted questions with these ids, in the same order as 'ids'.
+    Ids that do not exist are left out.
+    """
+    if not ids:
+        return []
+
+    rows = _execute(
+        select(*QUESTION_COLUMNS).where(questions.c.id.in_(ids)),
+        session
+    ).all()
+
+    position = {question_id: i for i, question_id in enumerate(ids)}
+    return _formatted(sorted(rows, key=lambda row: position[row[0]]))
+
+
+def unseen_question(category_id=None, seen=(), session=None):
+    """
+    The formatted question with the lowest id that is not in 'seen',
+    optionally in one category, or None if there are none left
+    """
+    query = select_questions().limit(1)
+
+    if category_id is not None:
+        query = query.where(questions.c.category == category_id)
+
+    seen_ids = [question_id for question_id in seen if isinstance(question_id, int)]
+    if seen_ids:
+        query = query.where(questions.c.id.not_in(seen_ids))
+
+    row = _execute(query, session).first()
+
+    return None if row is None else dict(zip(QUESTION_FIELDS, row))
+
+
+def questions_page(limit, after_id=None, offset=0, category_id=None, with_total=False, session=None):
+    """
+    A page of formatted questions, ordered by id, optionally in one category.
+    The page starts after 'after_id' if given (keyset), otherwise at 'offset'.
+
+    Returns the list of questions, or (questions, total) if 'with_total',
+    where total is the number of questions in the category (or in all),
+    counted in the same statement.
+    """
+    query = select_questions().limit(limit)
+    total_query = select(func.count(questions.c.id))
+
+    if category_id is not None:
+        query = query.where(questions.c.category == category_id)
+        total_query = total_query.where(questions.c.category == category_id)
+
+    if after_id is not None:
+        query = query.where(questions.c.id > after_id)
+    else:
+        query = query.offset(offset)
+
+    if not with_total:
+        return _formatted(_execute(query, session))
+
+    rows = _execute(query.add_columns(total_query.scalar_subquery()), session).all()
+
+    if rows:
+        total = rows[0][-1]
+    else:
+        # past the last page
+        total = _execute(total_query, session).scalar()
+
+    return _formatted(row[:-1] for row in rows), total
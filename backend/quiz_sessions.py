@@ -0,0 +1,202 @@
+"""
+Server-side quiz sessions
+"""
+
+from array import array
+import bisect
+from collections import OrderedDict
+import os
+import re
+import secrets
+import threading
+import time
+
+TTL_SECONDS = 30 * 60
+MAX_SESSIONS = 100000
+
+# the characters of secrets.token_urlsafe, so a token is a safe file name
+TOKEN_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+# expired session files are swept this often, as a fraction of the ttl
+SWEEP_FRACTION = 0.1
+
+
+class SeenSet:
+    """
+    A set of question ids stored as a sorted array, 4 bytes per id seen,
+    so a long quiz costs a few bytes per question instead of a growing list
+    of Python ints, whatever the ids are.
+    """
+
+    __slots__ = ("_ids",)
+
+    def __init__(self):
+        self._ids = array("I")
+
+    def add(self, question_id):
+        i = bisect.bisect_left(self._ids, question_id)
+        if i == len(self._ids) or self._ids[i] != question_id:
+            self._ids.insert(i, question_id)
+
+    def __contains__(self, question_id):
+        i = bisect.bisect_left(self._ids, question_id)
+        return i < len(self._ids) and self._ids[i] == question_id
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+
+class QuizSession:
+    __slots__ = ("category_id", "seen", "expires_at", "path")
+
+    def __init__(self, category_id, expires_at, path=None):
+        self.category_id = category_id
+        self.seen = SeenSet()
+        self.expires_at = expires_at
+        # the session's file, when the store keeps them in a directory
+        self.path = path
+
+    def mark_seen(self, question_id):
+        self.seen.add(question_id)
+        if self.path is not None:
+            # one short append, which other processes never see half done
+            with open(self.path, "a", encoding="ascii") as f:
+                f.write(str(question_id) + "\n")
+
+
+class QuizSessionStore:
+    """
+    Quiz sessions by token. A session expires 'ttl_seconds' after it was
+    last used. Expired sessions are evicted as new ones are created, and
+    the oldest are dropped if there are more than 'max_sessions'.
+
+    By default sessions live in this process. Behind several workers,
+    configure a 'directory' shared by them: each session is then a file
+    there (its category, then the ids it has seen, a line each), so any
+    worker can serve it. Its modification time is when it was last used,
+    and 'max_sessions' does not apply.
+    """
+
+    def __init__(self, ttl_seconds=TTL_SECONDS, max_sessions=MAX_SESSIONS):
+        self._ttl_seconds = ttl_seconds
+        self._max_sessions = max_sessions
+        self._directory = None
+        self._swept_at = 0.0
+        self._lock = threading.Lock()
+        # least recently used first
+        self._sessions = OrderedDict()
+
+    @property
+    def ttl_seconds(self):
+        return self._ttl_seconds
+
+    def configure(self, ttl_seconds, max_sessions, directory=None):
+        with self._lock:
+            self._ttl_seconds = ttl_seconds
+            self._max_sessions = max_sessions
+            self._directory = directory
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _evict(self, now):
+        while self._sessions:
+            token, session = next(iter(self._sessions.items()))
+            if session.expires_at > now and len(self._sessions) <= self._max_sessions:
+                break
+            del self._sessions[token]
+
+    def create(self, category_id=None):
+        """
+        Start a session and return its token
+        """
+        token = secrets.token_urlsafe(16)
+        if self._directory is not None:
+            with open(os.path.join(self._directory, token), "x", encoding="ascii") as f:
+                f.write(("" if category_id is None else str(category_id)) + "\n")
+            self._sweep()
+            return token
+
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[token] = QuizSession(category_id, now + self._ttl_seconds)
+            self._evict(now)
+        return token
+
+    def get(self, token):
+        """
+        The session for 'token', or None if it does not exist or has expired
+        """
+        if self._directory is not None:
+            return self._load(token)
+
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is None:
+                return None
+            if session.expires_at <= now:
+                del self._sessions[token]
+                return None
+            session.expires_at = now + self._ttl_seconds
+            self._sessions.move_to_end(token)
+            return session
+
+    def _load(self, token):
+        if not TOKEN_PATTERN.fullmatch(token):
+            return None
+
+        path = os.path.join(self._directory, token)
+        now = time.time()
+        try:
+            if os.stat(path).st_mtime + self._ttl_seconds <= now:
+                _remove(path)
+                return None
+            with open(path, encoding="ascii") as f:
+                lines = f.read().split("\n")
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+
+        category_id = int(lines[0]) if lines[0] else None
+        session = QuizSession(category_id, now + self._ttl_seconds, path)
+        for line in lines[1:]:
+            # the last line may still be being written
+            if line.isdigit():
+                session.seen.add(int(line))
+        return session
+
+    def _sweep(self):
+        """
+        Remove the expired session files, at most every SWEEP_FRACTION of the ttl
+        """
+        now = time.time()
+        with self._lock:
+            if now - self._swept_at < self._ttl_seconds * SWEEP_FRACTION:
+                return
+            self._swept_at = now
+
+        with os.scandir(self._directory) as entries:
+            for entry in entries:
+                try:
+                    expired = entry.stat().st_mtime + self._ttl_seconds <= now
+                except FileNotFoundError:
+                    continue
+                if expired:
+                    _remove(entry.path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+quiz_sessions = QuizSessionStore()
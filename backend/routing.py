@@ -0,0 +1,79 @@
+"""
+Read replica routing
+"""
+
+import random
+from contextlib import contextmanager
+
+from flask import g, has_request_context
+from flask_sqlalchemy.session import Session
+
+# bind keys of the replicas, see setup_db
+REPLICA_BIND_PREFIX = "replica_"
+
+
+def replica_bind_key(i):
+    return REPLICA_BIND_PREFIX + str(i)
+
+
+def _reads_from_replica():
+    return (
+        has_request_context()
+        and g.get("read_replica", False)
+        and not g.get("read_primary", False)
+    )
+
+
+@contextmanager
+def reading_primary():
+    """
+    Send the reads in the block to the primary, even in a read-only request
+    """
+    if not has_request_context():
+        yield
+        return
+
+    previous = g.get("read_primary", False)
+    g.read_primary = True
+    try:
+        yield
+    finally:
+        g.read_primary = previous
+
+
+class RoutingSession(Session):
+    """
+    A Flask-SQLAlchemy session that sends the reads of read-only requests
+    (see flaskr.replicas.read_only) to a replica, if any are configured.
+    Flushes and insert/update/delete statements always go to the primary,
+    and so does everything outside a request.
+
+    The replica is picked at random, once per session, so a request
+    sees a single replica.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and not self._flushing
+            and not getattr(clause, "is_dml", False)
+            and _reads_from_replica()
+        ):
+            replica = self._replica()
+            if replica is not None:
+                return replica
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _replica(self):
+        engines = self._db.engines
+        key = getattr(self, "_replica_key", None)
+        if key is None or key not in engines:
+            keys = [
+                name for name in engines
+                if isinstance(name, str) and name.startswith(REPLICA_BIND_PREFIX)
+            ]
+            if not keys:
+                return None
+            key = self._replica_key = random.choice(keys)
+        return engines[key]
@@ -0,0 +1,4 @@
+#!/bin/bash
+
+
+python -m uvicorn --factory flaskr.asgi:create_asgi_app --port 5000
@@ -0,0 +1,4 @@
+#!/bin/bash
+
+
+python -m gunicorn wsgi:app
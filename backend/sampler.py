@@ -0,0 +1,152 @@
+"""
+Random question sampling for the quiz
+"""
+
+from array import array
+import random
+import threading
+import time
+
+from blocking import run_blocking
+
+RESYNC_SECONDS = 60
+
+# random draws to try before falling back to a scan of the unseen ids
+MAX_ATTEMPTS = 8
+
+
+def _arrays(rows):
+    """
+    (all ids, {category id: ids}) of the (id, category_id) rows
+    """
+    all_ids = array("l")
+    by_category = {}
+    for question_id, category_id in rows:
+        all_ids.append(question_id)
+        if category_id is not None:
+            by_category.setdefault(category_id, array("l")).append(question_id)
+    return all_ids, by_category
+
+
+class QuestionSampler:
+    """
+    Keeps arrays of question ids, one for all questions and one per
+    category, so that a random question can be picked without asking
+    the database to sort every candidate row by random().
+
+    The arrays are loaded from the database on first use, kept up to date
+    by the write paths in models.py, and reloaded every 'resync_seconds'
+    to pick up writes made by other processes.
+
+    loader(session) must return an iterable of (id, category_id) rows.
+    """
+
+    def __init__(self, loader, resync_seconds=RESYNC_SECONDS):
+        self._loader = loader
+        self._resync_seconds = resync_seconds
+        self._lock = threading.Lock()
+        self._all = None
+        self._by_category = {}
+        self._loaded_at = 0.0
+
+    def configure(self, resync_seconds):
+        with self._lock:
+            self._resync_seconds = resync_seconds
+
+    def invalidate(self):
+        with self._lock:
+            self._all = None
+            self._by_category = {}
+
+    def load(self, session=None):
+        all_ids, by_category = run_blocking(_arrays, self._loader(session))
+
+        with self._lock:
+            self._all = all_ids
+            self._by_category = by_category
+            self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self, session):
+        stale = (
+            self._all is None
+            or time.monotonic() - self._loaded_at >= self._resync_seconds
+        )
+        if stale:
+            self.load(session)
+
+    def added(self, question_id, category_id):
+        with self._lock:
+            if self._all is None:
+                return
+            self._remove(question_id)
+            self._all.append(question_id)
+            if category_id is not None:
+                self._by_category.setdefault(category_id, array("l")).append(question_id)
+
+    def removed(self, question_id):
+        with self._lock:
+            if self._all is None:
+                return
+            self._remove(question_id)
+
+    def _remove(self, question_id):
+        # deletes are rare compared to draws, a linear scan is fine
+        for ids in (self._all, *self._by_category.values()):
+            try:
+                ids.remove(question_id)
+            except ValueError:
+                pass
+
+    def draw(self, category_id=None, seen=(), session=None):
+        """
+        Returns a random question id in the category (or in any category
+        if category_id is None) that is not in 'seen', or None if every
+        question has been seen.
+        """
+        self._ensure_loaded(session)
+
+        with self._lock:
+            ids = self._all if category_id is None else self._by_category.get(category_id)
+            if not ids:
+                return None
+
+            for _ in range(MAX_ATTEMPTS):
+                question_id = ids[random.randrange(len(ids))]
+                if question_id not in seen:
+                    return question_id
+
+            # most of the category has been seen
+            unseen = [question_id for question_id in ids if question_id not in seen]
+
+        if not unseen:
+            return None
+        return random.choice(unseen)
+
+    def draw_many(self, count, category_id=None, seen=(), session=None):
+        """
+        Returns up to 'count' distinct random question ids, in random order,
+        from the category (or any category if category_id is None)
+        that are not in 'seen'.
+        """
+        self._ensure_loaded(session)
+
+        with self._lock:
+            ids = self._all if category_id is None else self._by_category.get(category_id)
+            if not ids or count < 1:
+                return []
+
+            if count * 2 < len(ids):
+                drawn = []
+                picked = set()
+                for _ in range(count * MAX_ATTEMPTS):
+                    question_id = ids[random.randrange(len(ids))]
+                    if question_id not in seen and question_id not in picked:
+                        picked.add(question_id)
+                        drawn.append(question_id)
+                        if len(drawn) == count:
+                            return drawn
+
+            # a large part of the category is wanted or has been seen
+            unseen = [question_id for question_id in ids if question_id not in seen]
+
+        return random.sample(unseen, min(count, len(unseen)))
@@ -0,0 +1,297 @@
+"""
+Question search
+
+Two backends with the same matching rules:
+
+- Postgres: the search_vector tsvector column and its GIN index
+  (see migrations/versions/26307169f204_question_search_vector.py)
+- memory: an inverted index built from the questions table,
+  used for SQLite and for Postgres databases without the migration
+
+A search term is split into words. A question matches if every word is
+a prefix of some word in the question text (or the answer text, when
+answers are included). Results are ordered by relevance, best first.
+"""
+
+import bisect
+import heapq
+import re
+import threading
+
+from sqlalchemy import func, inspect, literal_column, select
+
+from blocking import run_blocking
+
+WORD_RE = re.compile(r"\w+")
+
+QUESTION_WEIGHT = 1.0
+ANSWER_WEIGHT = 0.4
+
+BACKENDS = ("auto", "postgres", "memory")
+
+# builds of the index to try while questions are being written
+LOAD_ATTEMPTS = 3
+
+
+def tokenize(text):
+    return [word.lower() for word in WORD_RE.findall(text or "")]
+
+
+class InvertedIndex:
+    """
+    Maps each word to the questions containing it, with the number of
+    times it appears in the question and in the answer.
+
+    The index is built from the database on first use and kept up to date
+    by the write paths in models.py. A write while it is being built may
+    be missing from the rows, so it bumps the version, and like
+    CategoryCache the build is redone when the version moved.
+
+    loader(session) must return an iterable of (id, question, answer) rows.
+    """
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._lock = threading.RLock()
+        self._postings = None  # word -> {id: (question hits, answer hits)}
+        self._words = []       # sorted keys of _postings, for prefix lookup
+        self._docs = {}        # id -> set of words, for removal
+        self._version = 0
+        # the version the index was built at
+        self._loaded_version = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+            self._postings = None
+            self._words = []
+            self._docs = {}
+
+    def _is_loaded(self):
+        return self._postings is not None and self._loaded_version == self._version
+
+    def _ensure_loaded(self, session):
+        for _ in range(LOAD_ATTEMPTS):
+            if self._is_loaded():
+                return
+
+            version = self._version
+            rows = self._loader(session)
+            built = run_blocking(self._build, rows)
+            with self._lock:
+                if self._is_loaded():
+                    return
+                self._postings, self._words, self._docs = built._postings, built._words, built._docs
+                self._loaded_version = version
+                if self._version == version:
+                    return
+
+        # still being written to: search what was loaded, the next search rebuilds it
+
+    def _build(self, rows):
+        """
+        A new index of the rows, built without holding the lock
+        """
+        built = InvertedIndex(self._loader)
+        built._postings = {}
+        for question_id, question, answer in rows:
+            built._add(question_id, question, answer, sort_words=False)
+        built._words = sorted(built._postings)
+        return built
+
+    def _add(self, question_id, question, answer, sort_words=True):
+        hits = {}
+        for word in tokenize(question):
+            q, a = hits.get(word, (0, 0))
+            hits[word] = (q + 1, a)
+        for word in tokenize(answer):
+            q, a = hits.get(word, (0, 0))
+            hits[word] = (q, a + 1)
+
+        for word, counts in hits.items():
+            postings = self._postings.get(word)
+            if postings is None:
+                postings = self._postings[word] = {}
+                if sort_words:
+                    bisect.insort(self._words, word)
+            postings[question_id] = counts
+
+        self._docs[question_id] = set(hits)
+
+    def _remove(self, question_id):
+        for word in self._docs.pop(question_id, ()):
+            postings = self._postings[word]
+            postings.pop(question_id, None)
+            if not postings:
+                del self._postings[word]
+                i = bisect.bisect_left(self._words, word)
+                if i < len(self._words) and self._words[i] == word:
+                    del self._words[i]
+
+    def added(self, question_id, question, answer):
+        with self._lock:
+            if self._postings is None:
+                # a build may be running, and miss this
+                self._version += 1
+                return
+            self._remove(question_id)
+            self._add(question_id, question, answer)
+
+    def removed(self, question_id):
+        with self._lock:
+            if self._postings is None:
+                self._version += 1
+                return
+            self._remove(question_id)
+
+    def _prefix_scores(self, prefix, include_answers):
+        """
+        {id: score} for questions with a word starting with 'prefix'
+        """
+        scores = {}
+        i = bisect.bisect_left(self._words, prefix)
+        while i < len(self._words) and self._words[i].startswith(prefix):
+            for question_id, (q, a) in self._postings[self._words[i]].items():
+                score = q * QUESTION_WEIGHT
+                if include_answers:
+                    score += a * ANSWER_WEIGHT
+                if score:
+                    scores[question_id] = scores.get(question_id, 0) + score
+            i += 1
+        return scores
+
+    def search(self, words, include_answers=False, session=None, limit=None, offset=0):
+        """
+        Returns (ids, total): a page of the ids of questions matching
+        all 'words', best first, and the total number of matches
+        """
+        if not words:
+            return [], 0
+
+        self._ensure_loaded(session)
+
+        with self._lock:
+            # the rarest prefix first, so the candidate set shrinks quickly
+            per_word = sorted(
+                (self._prefix_scores(word, include_answers) for word in words),
+                key=len
+            )
+
+        totals = per_word[0]
+        for scores in per_word[1:]:
+            totals = {
+                question_id: total + scores[question_id]
+                for question_id, total in totals.items()
+                if question_id in scores
+            }
+            if not totals:
+                break
+
+        def rank(question_id):
+            return (-totals[question_id], question_id)
+
+        if limit is None:
+            ranked = sorted(totals, key=rank)
+        else:
+            # only sort as much as is needed for this page
+            ranked = heapq.nsmallest(offset + limit, totals, key=rank)
+
+        return ranked[offset:], len(totals)
+
+
+class PostgresSearch:
+    """
+    Full-text search on the questions.search_vector column
+    """
+
+    def __init__(self, table):
+        self._table = table
+        self._vector = literal_column("search_vector")
+
+    def available(self, session):
+        bind = session.get_bind()
+        if bind.dialect.name != "postgresql":
+            return False
+        columns = inspect(bind).get_columns(self._table.name)
+        return any(column["name"] == "search_vector" for column in columns)
+
+    @staticmethod
+    def to_tsquery_text(words, include_answers):
+        # words come from tokenize() so contain no tsquery operators
+        label = ":*" if include_answers else ":*A"
+        return " & ".join(word + label for word in words)
+
+    def search(self, words, include_answers, session, limit=None, offset=0):
+        if not words:
+            return [], 0
+
+        query = func.to_tsquery("simple", self.to_tsquery_text(words, include_answers))
+        matches = self._vector.op("@@")(query)
+        id_column = self._table.c.id
+
+        rows = session.execute(
+            select(id_column, func.count().over())
+            .where(matches)
+            .order_by(func.ts_rank_cd(self._vector, query).desc(), id_column)
+            .limit(limit)
+            .offset(offset)
+        ).all()
+
+        if rows:
+            return [row[0] for row in rows], rows[0][1]
+
+        if not offset:
+            return [], 0
+
+        # past the last page, count separately
+        total = session.execute(
+            select(func.count()).select_from(self._table).where(matches)
+        ).scalar()
+        return [], total
+
+
+class QuestionSearch:
+    """
+    Chooses a search backend and keeps the in-memory index in sync.
+
+    backend is one of BACKENDS. "auto" uses Postgres full-text search
+    when the database has the search_vector column, otherwise memory.
+    """
+
+    def __init__(self, table, loader, get_session, backend="auto"):
+        self.index = InvertedIndex(loader)
+        self._postgres = PostgresSearch(table)
+        self._get_session = get_session
+        self.configure(backend)
+
+    def configure(self, backend):
+        if backend not in BACKENDS:
+            raise ValueError("Unknown search backend: " + str(backend))
+        self._backend = backend
+        self._resolved = None if backend == "auto" else backend
+        self.index.invalidate()
+
+    def backend(self, session):
+        if self._resolved is None:
+            self._resolved = "postgres" if self._postgres.available(session) else "memory"
+        return self._resolved
+
+    def search(self, term, include_answers=False, session=None, limit=None, offset=0):
+        """
+        Returns (ids, total): up to 'limit' ids of the questions matching
+        'term', best first, starting at 'offset', and the total number of matches
+        """
+        session = session or self._get_session()
+        words = tokenize(term)
+        if self.backend(session) == "postgres":
+            return self._postgres.search(words, include_answers, session, limit, offset)
+        return self.index.search(words, include_answers, session, limit, offset)
+
+    def added(self, question_id, question, answer):
+        self.index.added(question_id, question, answer)
+
+    def removed(self, question_id):
+        self.index.removed(question_id)
+
+    def invalidate(self):
+        self.index.invalidate()
@@ -17,4 +17,10 @@ echo "Importing..."
 
 psql -U $PGUSER -d trivia -f "trivia.psql"
 
+echo "Migrating..."
+
+# trivia.psql creates the baseline schema, apply the migrations after it
+FLASK_APP=flaskr python -m flask db stamp 7f156709a72a
+FLASK_APP=flaskr python -m flask db upgrade
+
 echo "DONE"
\ No newline at end of file
@@ -0,0 +1,7 @@
+"""
+The app for a WSGI server, see gunicorn.conf.py
+"""
+
+from flaskr import create_app
+
+app = create_app()